@@ -34,7 +34,7 @@ from common import generate_uuid, epoch_to_time, prepare_csv
 from common.hacks import hack_read_control, hack_write_control, hack_read_settings, hack_write_settings, hack_prepare_data, hack_read_current
 from updater import *  # Library for doing project updates from GitHub
 from file_mgmt.common import fixup_assets, read_json_file_data, update_json_file_data, remove_assets
-from file_mgmt.cookfile import read_cookfile, upgrade_cookfile, prepare_chartdata
+from file_mgmt.cookfile import read_cookfile, upgrade_cookfile, prepare_chartdata, reduce_chartdata
 from file_mgmt.media import add_asset, set_thumbnail, unpack_thumb
 from file_mgmt.recipes import read_recipefile, create_recipefile
 
@@ -220,9 +220,8 @@ def history_page(action=None):
 		if(action == 'setmins'):
 			if('minutes' in response):
 				if(response['minutes'] != ''):
-					num_items = int(response['minutes']) * 20
 					settings['history_page']['minutes'] = int(response['minutes'])
-					write_settings(settings)
+					patch_settings({ 'history_page.minutes' : settings['history_page']['minutes'] })
 
 	elif (request.method == 'GET') and (action == 'export'):
 		exportfilename = prepare_csv()
@@ -259,21 +258,29 @@ def history_update(action=None):
 		# POST - Get number of minutes into the history to refresh the history chart
 		control = read_control()
 		request_json = request.json
+		now_ms = int(time.time() * 1000)
+		end_ms = None 
 		if 'num_mins' in request_json:
-			num_items = int(request_json['num_mins']) * 20 if int(request_json['num_mins']) > 0 else 20 # Calculate number of items requested
-			settings['history_page']['minutes'] = int(request_json['num_mins']) if int(request_json['num_mins']) > 0 else 1
-			write_settings(settings)
+			num_mins = int(request_json['num_mins']) if int(request_json['num_mins']) > 0 else 1
+			settings['history_page']['minutes'] = num_mins
+			patch_settings({ 'history_page.minutes' : num_mins })
+			start_ms = now_ms - (num_mins * 60000)
+		elif 'start_ms' in request_json:
+			# Visible window of a zoomed / panned chart 
+			start_ms = int(request_json['start_ms'])
+			end_ms = int(request_json['end_ms']) if request_json.get('end_ms', None) is not None else None
 		elif 'zoom' in request_json:
-			num_items = int(request_json['zoom']) * 20
+			start_ms = now_ms - (int(request_json['zoom']) * 60000)
 		else: 
-			num_items = int(settings['history_page']['minutes'] * 20)
+			start_ms = now_ms - (int(settings['history_page']['minutes']) * 60000)
 
 		# Get Chart Data Structures
-		json_response = prepare_chartdata(settings['history_page']['probe_config'], num_items=num_items, reduce=True, data_points=settings['history_page']['datapoints'])
+		json_response = prepare_chartdata(settings['history_page']['probe_config'], num_items=0, reduce=True, data_points=settings['history_page']['datapoints'], start_ms=start_ms, end_ms=end_ms, reduce_mode=settings['history_page']['reduce_mode'])
 		json_response['ui_hash'] = create_ui_hash()
 		# Calculate Displayed Start Time
-		displayed_starttime = time.time() - (int(num_items / 20) * 60)
+		displayed_starttime = start_ms / 1000
 		json_response['annotations'] = _prepare_annotations(displayed_starttime)
+		json_response['annotation_count'] = read_metrics_count()
 		'''
 		json_response = {
 			'annotations' : [], 
@@ -284,6 +291,38 @@ def history_update(action=None):
 		'''
 		return jsonify(json_response)
 
+	elif action == 'since':
+		# GET - Samples and annotations newer than what the client already has, in column-oriented form 
+		#  (t = timestamp of the last sample on the chart, a = number of annotations (metrics records) on the chart)
+		since_ms = request.args.get('t', default=0, type=int)
+		annotation_count = request.args.get('a', default=0, type=int)
+		control = read_control()
+
+		json_response = { 'T' : [], 'P' : {}, 'F' : {}, 'NT' : {}, 'PSP' : [] }
+		history = read_history(start_ms=since_ms + 1, columns=True)
+		if history != []:
+			for key in json_response.keys():
+				if isinstance(history[key], dict):
+					json_response[key] = { subkey : history_column_values(column) for subkey, column in history[key].items() }
+				else:
+					json_response[key] = history_column_values(history[key])
+
+		metrics_count = read_metrics_count()
+		if metrics_count < annotation_count:
+			# Metrics were flushed (i.e. new cook), so the client needs to reload the chart 
+			json_response['reset'] = True
+		else:
+			json_response['reset'] = False
+			json_response['annotations'] = {}
+			if metrics_count > annotation_count:
+				new_metrics = read_metrics(all=True, start=annotation_count)
+				json_response['annotations'] = _prepare_annotations(0, metrics_data=new_metrics, start_index=annotation_count)
+			json_response['annotation_count'] = metrics_count
+		json_response['mode'] = control['mode']
+		json_response['ui_hash'] = create_ui_hash()
+
+		return jsonify(json_response)
+
 	return jsonify({'status' : 'ERROR'})
 
 @app.route('/cookfiledata', methods=['POST', 'GET'])
@@ -300,11 +339,14 @@ def cookfiledata(action=None):
 
 			if(status == 'OK'):
 				annotations = _prepare_annotations(0, cookfiledata['events'])
+				graph_data = cookfiledata['graph_data']
+				if requestjson.get('data_points', 0) > 0:
+					graph_data = reduce_chartdata(graph_data, int(requestjson['data_points']), settings['history_page']['reduce_mode'])
 
 				json_data = {
-					'chart_data' : cookfiledata['graph_data']['chart_data'],
-					'time_labels' : cookfiledata['graph_data']['time_labels'],
-					'probe_mapper' : cookfiledata['graph_data']['probe_mapper'],
+					'chart_data' : graph_data['chart_data'],
+					'time_labels' : graph_data['time_labels'],
+					'probe_mapper' : graph_data['probe_mapper'],
 					'annotations' : annotations
 				}
 				return jsonify(json_data)
@@ -941,11 +983,11 @@ def events_page(action=None):
 	if(request.method == 'POST') and ('form' in request.content_type):
 		requestform = request.form 
 		if 'eventslist' in requestform:
-			event_list = read_events(legacy=False)
 			page = int(requestform['page'])
 			reverse = True if requestform['reverse'] == 'true' else False
 			itemsperpage = int(requestform['itemsperpage'])
-			pgntd_data = _paginate_list(event_list, reversesortorder=reverse, itemsperpage=itemsperpage, page=page)
+			pgntd_data = _paginate_log('/tmp/events.log', reversesortorder=reverse, itemsperpage=itemsperpage, page=page, 
+				lineformat=lambda index, line: line.split(" ",2))
 			return render_template('_events_list.html', pgntd_data = pgntd_data)
 		else:
 			return ('Error')
@@ -977,12 +1019,11 @@ def logs_page(action=None):
 			return send_file(log_file_name, as_attachment=True, max_age=0)
 		elif 'eventslist' in requestform:
 			log_file_name = requestform['logfile']
-			event_list = read_log_file(LOGS_FOLDER + log_file_name)
-			event_list = add_line_numbers(event_list)
 			page = int(requestform['page'])
 			reverse = True if requestform['reverse'] == 'true' else False
 			itemsperpage = int(requestform['itemsperpage'])
-			pgntd_data = _paginate_list(event_list, reversesortorder=reverse, itemsperpage=itemsperpage, page=page)
+			pgntd_data = _paginate_log(LOGS_FOLDER + log_file_name, reversesortorder=reverse, itemsperpage=itemsperpage, page=page, 
+				lineformat=lambda index, line: [index, line])
 			return render_template('_log_list.html', pgntd_data = pgntd_data, log_file_name=log_file_name)
 		else:
 			return ('Error')
@@ -1869,6 +1910,8 @@ def settings_page(action=None):
 			settings['history_page']['autorefresh'] = 'off'
 		if _is_not_blank(response, 'datapoints'):
 			settings['history_page']['datapoints'] = int(response['datapoints'])
+		if _is_not_blank(response, 'reducemode'):
+			settings['history_page']['reduce_mode'] = response['reducemode']
 
 		# This check should be the last in this group
 		if control['mode'] != 'Stop' and _is_checked(response, 'ext_data') != settings['globals']['ext_data']:
@@ -2115,7 +2158,7 @@ def admin_page(action=None):
 		if 'clearpelletdb' in response:
 			if response['clearpelletdb'] == 'true':
 				write_log('Clearing Pellet Database.')
-				os.system('rm pelletdb.json')
+				delete_pellet_db()
 
 		if 'clearpelletdblog' in response:
 			if response['clearpelletdblog'] == 'true':
@@ -2129,7 +2172,7 @@ def admin_page(action=None):
 				read_history(0, flushhistory=True)
 				read_control(flush=True)
 				os.system('rm settings.json')
-				os.system('rm pelletdb.json')
+				delete_pellet_db()
 				settings = default_settings()
 				control = default_control()
 				write_settings(settings)
@@ -2349,7 +2392,13 @@ def api_page(action=None):
 			pelletlevel = pelletdb['current']['hopper_level']
 			pelletid = pelletdb['current']['pelletid']
 			pellets = f'{pelletdb["archive"][pelletid]["brand"]} {pelletdb["archive"][pelletid]["wood"]}'
-			return jsonify({'hopper_level': pelletlevel, 'hopper_pellets': pellets}) 
+			return jsonify({'hopper_level': pelletlevel, 'hopper_pellets': pellets})
+		elif action == 'controlcache':
+			return jsonify({'control_cache' : read_control_cache_stats()}), 201
+		elif action == 'settingscache':
+			return jsonify({'settings_cache' : read_settings_cache_stats()}), 201
+		elif action == 'loopstats':
+			return jsonify({'loop_stats' : read_loop_stats()}), 201
 		else:
 			return jsonify({'Error':'Received GET request, without valid action'}), 404
 	elif request.method == 'POST':
@@ -3065,9 +3114,9 @@ def create_ui_hash():
 	global settings 
 	return hash(json.dumps(settings['probe_settings']['probe_map']['probe_info']))
 
-def _prepare_annotations(displayed_starttime, metrics_data=[]):
+def _prepare_annotations(displayed_starttime, metrics_data=[], start_index=0):
 	if(metrics_data == []):
-		metrics_data = read_metrics(all=True)
+		metrics_data = read_metrics(all=True, start=start_index)
 	annotation_json = {}
 	# Process Additional Metrics Information for Display
 	for index in range(0, len(metrics_data)):
@@ -3110,7 +3159,7 @@ def _prepare_annotations(displayed_starttime, metrics_data=[]):
 								},
 							'display': True
 						}
-			annotation_json[f'event_{index}'] = annotation
+			annotation_json[f'event_{index + start_index}'] = annotation
 
 	return(annotation_json)
 
@@ -3212,6 +3261,36 @@ def _paginate_list(datalist, sortkey='', reversesortorder=False, itemsperpage=10
 
 	return (pagination)
 
+def _paginate_log(filepath, reversesortorder=False, itemsperpage=10, page=1, lineformat=lambda index, line: line):
+	# Same as _paginate_list() for the lines of a log file, but only the lines on the page are read from the file
+	listlength = count_log_lines(filepath)
+	lastpage = max((listlength // itemsperpage) + ((listlength % itemsperpage) > 0), 1)
+	curpage = min(max(page, 1), lastpage)
+	prevpage = curpage - 1 if curpage > 1 else 1
+	nextpage = curpage + 1 if curpage < lastpage else lastpage 
+
+	#  Calculate starting / ending position (the newest lines are first when reversed)
+	start = itemsperpage * (curpage - 1)
+	end = min(start + itemsperpage, listlength)
+	if reversesortorder:
+		start, end = listlength - end, listlength - start
+	lines = read_log_lines(filepath, start, end - start)
+	displaydata = [lineformat(start + index, line) for index, line in enumerate(lines)]
+	if reversesortorder:
+		displaydata.reverse()
+
+	pagination = {
+		'displaydata' : displaydata,
+		'curpage' : curpage,
+		'prevpage' : prevpage,
+		'nextpage' : nextpage, 
+		'lastpage' : lastpage,
+		'reverse' : 'true' if reversesortorder else 'false',
+		'itemspage' : itemsperpage
+	}
+
+	return (pagination)
+
 def _get_cookfilelist(folder=HISTORY_FOLDER):
 	# Grab list of Historical Cook Files
 	if not os.path.exists(folder):
@@ -3476,11 +3555,8 @@ def get_app_data(action=None, type=None):
 		return read_pellet_db()
 
 	elif action == 'events_data':
-		event_list, num_events = read_events()
-		events_trim = []
-		for x in range(min(num_events, 60)):
-			events_trim.append(event_list[x])
-		return { 'events_list' : events_trim }
+		event_list, num_events = read_events(max_events=60)
+		return { 'events_list' : event_list[:60] }
 	
 	elif action == 'history_data':
 		num_items = settings['history_page']['minutes'] * 20
@@ -3546,7 +3622,7 @@ def get_app_data(action=None, type=None):
 
 		if type == 'pelletdb':
 			backup_file = BACKUP_PATH + 'PelletDB_' + time_str + '.json'
-			os.system(f'cp pelletdb.json {backup_file}')
+			export_pellet_db(backup_file)
 			return read_pellet_db()
 
 	elif action == 'updater_data':
@@ -3623,7 +3699,7 @@ def post_app_data(action=None, type=None, json_data=None):
 			return {'response': {'result':'success'}}
 		elif type == 'clear_pelletdb':
 			write_log('Clearing Pellet Database.')
-			os.system('rm pelletdb.json')
+			delete_pellet_db()
 			return {'response': {'result':'success'}}
 		elif type == 'clear_pelletdb_log':
 			pelletdb = read_pellet_db()
@@ -14,17 +14,32 @@ Description: This library provides functions that are common to
  Imported Modules
 ==============================================================================
 '''
+import sys
 import time
 import datetime
 import os
 import io
 import json
 import math
+import struct
+import base64
+import zlib
 import redis
 import uuid
 import random
+import pickle
+import sqlite3
+import queue
+import atexit
 import logging
+import logging.handlers
+import threading
+from array import array
 from ratelimitingfilter import RateLimitingFilter
+try:
+	import numpy as np  # Optional, history columns are returned as NumPy arrays when available
+except ImportError:
+	np = None
 
 # *****************************************
 # Constants and Globals 
@@ -49,6 +64,114 @@ COLOR_LIST = [
 # Setup Command / Status database connection Global 
 cmdsts = redis.StrictRedis('localhost', 6379, charset="utf-8", decode_responses=True)
 
+# Origins of direct control writes that are made from within the control process.  Direct writes from any other 
+#  origin are published to the control notify channel, so that the control loop picks them up immediately. 
+CONTROL_ORIGINS = ['control', 'executor', 'notifications']
+
+# In-process cache of the control data.  The cache is validated against the 'control:revision' counter, which is 
+#  incremented on every direct write, so the control data is only parsed again after it has changed.  The snapshot 
+#  is pickled so that each caller gets its own copy to modify.  
+control_cache = {
+	'revision' : None,
+	'snapshot' : None,
+	'parses' : 0,  			# Number of times the control data was fetched and parsed
+	'parses_avoided' : 0  	# Number of reads served from the snapshot
+}
+
+# In-process cache of the settings file.  The cache is validated against the modification time, inode and size of 
+#  settings.json, so the file is only parsed again after it has been written (by either process).  As with the control 
+#  cache, the snapshot is pickled so that each caller gets its own copy to modify. 
+settings_cache = {
+	'lock' : threading.RLock(),  # Serializes the writers (and cache updates) of the threads of the process
+	'key' : None,  			# (st_mtime_ns, st_ino, st_size) of the file the snapshot was read from
+	'snapshot' : None,
+	'sections' : {},  		# Top level section -> [value, serialized text or None] as last read / written
+	'parses' : 0,
+	'parses_avoided' : 0
+}
+
+# Pellet database.  The pellet database is stored in SQLite, with a table per section (archive and log indexed), and 
+#  read_pellet_db() / write_pellet_db() convert to and from the same dictionary format as the original pelletdb.json. 
+#  Reads are served from a pickled snapshot while SQLite's data_version shows no commits from other connections, and 
+#  writes only touch the rows that changed.  The legacy JSON file is imported the first time the database is created, 
+#  and then renamed, so that a database recreated later (i.e. after corruption) doesn't import the stale data again. 
+PELLETDB_FILE = 'pelletdb.sqlite'
+PELLETDB_JSON_FILE = 'pelletdb.json'
+PELLETDB_JSON_IMPORTED_FILE = 'pelletdb.json.imported'
+PELLETDB_SCHEMA_VERSION = 1
+PELLETDB_SCHEMA = '''
+	CREATE TABLE IF NOT EXISTS current (key TEXT PRIMARY KEY, value TEXT);
+	CREATE TABLE IF NOT EXISTS brands (name TEXT PRIMARY KEY, position INTEGER);
+	CREATE TABLE IF NOT EXISTS woods (name TEXT PRIMARY KEY, position INTEGER);
+	CREATE TABLE IF NOT EXISTS archive (id TEXT PRIMARY KEY, brand TEXT, wood TEXT, profile TEXT);
+	CREATE INDEX IF NOT EXISTS archive_brand ON archive (brand);
+	CREATE INDEX IF NOT EXISTS archive_wood ON archive (wood);
+	CREATE TABLE IF NOT EXISTS log (date_loaded TEXT PRIMARY KEY, pelletid TEXT);
+	CREATE INDEX IF NOT EXISTS log_pelletid ON log (pelletid);
+	CREATE TABLE IF NOT EXISTS sections (key TEXT PRIMARY KEY, value TEXT);
+'''
+pellet_db = {
+	'connection' : None,
+	'lock' : threading.RLock(),  # The connection is shared by the threads of the process
+	'data_version' : None,
+	'data' : None, 		# Private copy of the database as last read / written (to find the changed rows on write)
+	'snapshot' : None
+}
+
+# Channel on which write_settings() publishes the key paths that changed (with their new values), so that the other 
+#  process can apply them in memory instead of reloading the settings. 
+SETTINGS_CHANNEL = 'settings:changes'
+
+# Write batch used by the control loop.  While a batch is open, Redis writes are queued on a single transaction 
+#  pipeline and sent in one round trip when the batch is flushed.  The batch belongs to the thread that opened it, so 
+#  writes from other threads (i.e. the display or probe acquisition threads) are still sent directly.  
+#   write_batch.pipe : Open pipeline, or None
+#   write_batch.snapshot : (index of the revision increment in the batch, control snapshot) for the last control write
+write_batch = threading.local()
+
+# History sample encoding.  Samples are stored in the 'control:history' sorted set, scored by their timestamp ('T'), 
+#  as '~<schema id>|<base64 packed values>', where the values are packed in a fixed layout (T as int64, then PSP and 
+#  each probe group as float64) and the layout with the probe labels is stored once per schema id in the 'control:history:schema' hash.  Schema ids are derived from the 
+#  layout itself, so a cached schema never goes stale.  Samples starting with '{' are legacy JSON samples.  
+HISTORY_SCHEMA_VERSION = 1
+HISTORY_GROUPS = ['P', 'F', 'NT', 'AUX', 'EXD']
+history_schemas = {}  # Decoded schemas by schema id (used when reading)
+history_encoder = {
+	'labels' : None,	# Label layout that the current schema was built for
+	'id' : None,
+	'layout' : None, 	# JSON string of the layout, as stored in the schema hash
+	'struct' : None
+}
+
+# Downsampled history tiers, kept alongside the raw samples so that long charts don't need to load every raw sample. 
+#  Each tier is a sorted set of JSON buckets in 'control:history:<tier>', scored by the bucket start time ('T'), holding 
+#  the mean of each probe over the bucket period, the min/max of the temperature probes ('MIN' / 'MAX'), the last setpoint / notify targets and the sample count ('N').  
+#  'factor' is the nominal number of raw samples (3 seconds apart) per bucket.  Ordered finest to coarsest. 
+HISTORY_TIERS = {
+	'30s' : { 'period' : 30000, 'factor' : 10, 'maxsizelines' : 2880 },		# 24 hours of 30 second buckets
+	'5m' : { 'period' : 300000, 'factor' : 100, 'maxsizelines' : 288 }		# 24 hours of 5 minute buckets
+}
+# The open buckets are kept in memory by the process writing the history (control), so a history flush from another 
+#  process increments 'control:history:generation', and the writer drops its open buckets when the generation changes.  
+history_rollup = {
+	'generation' : None,	# History generation that the open buckets belong to
+	'buckets' : {}		# Open bucket accumulator for each tier
+}
+
+# Log writers.  Loggers created by create_logger() only put records on a queue, and a QueueListener per log file 
+#  writes them from a background thread, so logging never blocks the caller on file I/O.  The queues are queue.Queue 
+#  (not SimpleQueue), which eventlet's monkey patching turns green, so that the writer doesn't block the hub of the 
+#  web app (gunicorn -k eventlet). 
+EVENT_LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+log_listeners = {}  # QueueListener for each log file
+event_logger = None  # Cached 'events' logger used by write_log()
+
+# Log reading.  A sparse index of the byte offset of every LOG_INDEX_STRIDE'th line is kept for each log file, and 
+#  extended as the file grows, so that any page of lines can be read by seeking close to it.  
+LOG_INDEX_STRIDE = 256
+LOG_READ_BLOCK = 8192
+log_indexes = {}
+
 
 '''
 ==============================================================================
@@ -65,17 +188,46 @@ def create_logger(name, filename='./logs/pifire.log', messageformat='%(asctime)s
 	'''
 	if not logger.hasHandlers():
 		logger.setLevel(level)
-		formatter = logging.Formatter(fmt=messageformat, datefmt='%Y-%m-%d %H:%M:%S')
-		# datefmt='%Y-%m-%d %H:%M:%S'
 		# Add a rate limit filter for the voltage error logging 
 		config = {'match': ['An error occurred reading the voltage from one of the ports.']}
 		ratelimit = RateLimitingFilter(rate=1, per=60, burst=5, **config)  # Allow 1 per 60s (with periodic burst of 5)
-		handler = logging.FileHandler(filename)        
-		handler.setFormatter(formatter)
-		handler.addFilter(ratelimit)  # Add the rate limit filter
+		handler = logging.handlers.QueueHandler(_log_listener(filename, messageformat).queue)
+		handler.addFilter(ratelimit)  # Add the rate limit filter (before queuing, so suppressed records are never queued)
 		logger.addHandler(handler)
 	return logger
 
+def _log_listener(filename, messageformat):
+	''' Get (or start) the background writer for a log file '''
+	listener = log_listeners.get(filename, None)
+	if listener is None:
+		formatter = logging.Formatter(fmt=messageformat, datefmt='%Y-%m-%d %H:%M:%S')
+		handler = logging.FileHandler(filename)        
+		handler.setFormatter(formatter)
+		listener = logging.handlers.QueueListener(queue.Queue(), handler)
+		listener.start()
+		log_listeners[filename] = listener
+	return listener
+
+def _stop_log_listeners():
+	''' Write out any queued records and stop the background writers (at exit) '''
+	for listener in log_listeners.values():
+		listener.stop()
+
+def _restart_log_listeners():
+	''' The writer threads don't survive a fork, so give the child process new queues and threads '''
+	for filename, listener in log_listeners.items():
+		log_queue = queue.Queue()
+		for name in list(logging.root.manager.loggerDict):
+			for handler in getattr(logging.root.manager.loggerDict[name], 'handlers', []):
+				if isinstance(handler, logging.handlers.QueueHandler) and handler.queue is listener.queue:
+					handler.queue = log_queue
+		listener = logging.handlers.QueueListener(log_queue, *listener.handlers)
+		listener.start()
+		log_listeners[filename] = listener
+
+atexit.register(_stop_log_listeners)
+os.register_at_fork(after_in_child=_restart_log_listeners)
+
 def default_settings():
 	settings = {}
 
@@ -85,6 +237,12 @@ def default_settings():
 	settings['probe_settings'] = {}
 	settings['probe_settings']['probe_profiles'] = _default_probe_profiles()
 	settings['probe_settings']['probe_map'] = default_probe_map(settings['probe_settings']['probe_profiles'])
+	settings['probe_settings']['acquisition'] = {
+		'threaded' : False,		# Set to True to sample each probe device on its own thread
+		'sample_period' : 0.1,	# Seconds between samples for each probe device, in threaded acquisition
+		'concurrent' : False,	# Set to True to read the devices on each bus in parallel with the other buses
+		'device_timeout' : 0.5	# Seconds to wait for each device in concurrent reads, before using its last data
+	}
 
 	settings['globals'] = {
 		'grill_name' : '',
@@ -277,6 +435,7 @@ def default_settings():
 		'clearhistoryonstart' : True, 	# Clear history when StartUp Mode selected
 		'autorefresh' : 'on', 			# Sets history graph to auto refresh ('live' graph)
 		'datapoints' : 60, 				# Number of data points to show on the history chart
+		'reduce_mode' : 'lttb',			# Chart downsampling mode ('lttb', 'minmax' or 'stride')
 		'probe_config' : default_probe_config(settings)
 	}
 
@@ -704,8 +863,23 @@ def read_control(flush=False):
 
 			control = default_control()
 			write_control(control, direct_write=True, origin='common')
+		elif _batch_snapshot() is not None:
+			# Control written in this thread's open batch, but not sent yet
+			control = pickle.loads(_batch_snapshot()[1])
 		else: 
-			control = json.loads(cmdsts.get('control:general'))
+			revision = cmdsts.get('control:revision')
+			if revision is not None and revision == control_cache['revision']:
+				control = pickle.loads(control_cache['snapshot'])
+				control_cache['parses_avoided'] += 1
+			else:
+				pipe = cmdsts.pipeline()
+				pipe.get('control:revision')
+				pipe.get('control:general')
+				revision, control_string = pipe.execute()
+				control = json.loads(control_string)
+				control_cache['revision'] = revision
+				control_cache['snapshot'] = pickle.dumps(control, protocol=pickle.HIGHEST_PROTOCOL)
+				control_cache['parses'] += 1
 	except:
 		control = default_control()
 
@@ -720,13 +894,129 @@ def write_control(control, direct_write=False, origin='unknown'):
 	"""
 	global cmdsts
 
+	batch = _batch_pipe()
 	if direct_write: 
-		cmdsts.set('control:general', json.dumps(control))
+		pipe = batch if batch is not None else cmdsts.pipeline()
+		pipe.set('control:general', json.dumps(control))
+		pipe.incr('control:revision')
+		revision_index = len(pipe) - 1
+		if origin not in CONTROL_ORIGINS:
+			pipe.publish('control:notify', origin)
+		snapshot = pickle.dumps(control, protocol=pickle.HIGHEST_PROTOCOL)
+		if pipe is batch:
+			# The revision is not known until the batch is flushed
+			control_cache['revision'] = None
+			write_batch.snapshot = (revision_index, snapshot)
+		else: 
+			# The data just written is the latest revision, so keep it as the snapshot for the next read
+			control_cache['revision'] = str(pipe.execute()[revision_index])
+			control_cache['snapshot'] = snapshot
 	else: 
 		control['origin'] = origin 
-		cmdsts.rpush('control:command', json.dumps(control))
+		pipe = cmdsts.pipeline(transaction=False)
+		pipe.rpush('control:command', json.dumps(control))
+		pipe.publish('control:notify', origin)  # Wake the control loop to execute the command
+		pipe.execute()
 		#print(f' -> Command Pushed to Queue by {origin}')
 
+def begin_write_batch():
+	"""
+	Open a write batch.  Until flush_write_batch() is called, writes to the Redis DB from write_control (direct), 
+	write_current, write_tr, write_status, write_metrics and write_history are queued instead of sent.
+	"""
+	global cmdsts
+
+	if _batch_pipe() is None:
+		write_batch.pipe = cmdsts.pipeline()
+		write_batch.snapshot = None
+
+def flush_write_batch():
+	"""
+	Send all queued writes in the open write batch to the Redis DB in a single transaction and close the batch
+	"""
+	batch = _batch_pipe()
+	if batch is None:
+		return
+
+	snapshot = _batch_snapshot()
+	write_batch.pipe = None
+	write_batch.snapshot = None
+
+	if len(batch) > 0:
+		results = batch.execute()
+		if snapshot is not None:
+			control_cache['revision'] = str(results[snapshot[0]])
+			control_cache['snapshot'] = snapshot[1]
+
+def _redis_writer():
+	""" Get the open write batch if there is one, otherwise the Redis DB connection """
+	global cmdsts
+	batch = _batch_pipe()
+	return batch if batch is not None else cmdsts
+
+def _batch_pipe():
+	""" Open write batch pipeline of the current thread, or None """
+	return getattr(write_batch, 'pipe', None)
+
+def _batch_snapshot():
+	""" Control snapshot queued in the open write batch of the current thread, or None """
+	return getattr(write_batch, 'snapshot', None) if _batch_pipe() is not None else None
+
+def read_control_cache_stats():
+	"""
+	Read the control cache counters for this process
+
+	:return: Dictionary with the cached revision, number of parses and number of parses avoided
+	"""
+	return {
+		'revision' : control_cache['revision'],
+		'parses' : control_cache['parses'],
+		'parses_avoided' : control_cache['parses_avoided']
+	}
+
+def read_settings_cache_stats():
+	"""
+	Read the settings cache counters for this process
+
+	:return: Dictionary with the number of parses and number of parses avoided
+	"""
+	return {
+		'parses' : settings_cache['parses'],
+		'parses_avoided' : settings_cache['parses_avoided']
+	}
+
+def subscribe_control_notify():
+	"""
+	Subscribe to the control notify channel, which signals new commands in the queue 
+	and direct control writes made outside of the control process
+
+	:return: Redis PubSub object to pass to wait_for_control_notify()
+	"""
+	global cmdsts
+
+	listener = cmdsts.pubsub(ignore_subscribe_messages=True)
+	listener.subscribe('control:notify')
+	return listener
+
+def wait_for_control_notify(listener, timeout=0.05):
+	"""
+	Block until a control notification is received, or until the timeout expires
+
+	:param listener: PubSub object from subscribe_control_notify()
+	:param timeout: Maximum time to wait in seconds
+	:return: True if notified (or if the listener failed), False if the timeout expired
+	"""
+	try:
+		if listener.get_message(timeout=timeout) is None:
+			return False
+		# Drain any other pending notifications, since a single read of control covers all of them
+		while listener.get_message(timeout=0.0) is not None:
+			pass
+	except:
+		# Fall back to polling if the subscription is lost
+		time.sleep(timeout)
+	return True
+
 def execute_commands():
 	"""
 	Execute Control Commands in Queue from Redis DB
@@ -827,29 +1117,51 @@ def write_warning(warning):
 		event = 'Unable to reach Redis database.  You may need to reinstall PiFire or enable redis-server.'
 		write_log(event)
 
-def read_metrics(all=False):
+def read_metrics(all=False, start=0, count=0):
 	"""
-	Read Metrics from Redis DB
+	Read Metrics from Redis DB.  Closed records (previous modes) are kept in the 'metrics:general' list, and the 
+	record for the current mode is kept in the 'metrics:current' hash (one JSON encoded value per field).
 
-	:param all: True to read entire list. False for top of list.
+	:param all: True to read the list of records (closed records followed by the current record). False for the current record.
+	:param start: When reading the list, index of the first record to read (to read only newer records)
+	:param count: When reading the list, maximum number of records to read (0 to read to the end of the list)
 	"""
 	global cmdsts
 
-	if not(cmdsts.exists('metrics:general')):
-		write_metrics(flush=True)
-		return([])
-	
 	if all: 
-		# Read entire list of Metrics
-		llength = cmdsts.llen('metrics:general')
-		metrics = cmdsts.lrange('metrics:general', 0, -1)
+		# Read the list of Metrics (from the start index), closed records and the current record in one transaction
+		end = start + count - 1 if count > 0 else -1
+		pipe = cmdsts.pipeline()
+		pipe.llen('metrics:general')
+		pipe.lrange('metrics:general', start, end)
+		pipe.hgetall('metrics:current')
+		closed_count, metrics, current = pipe.execute()
 		metrics_list = []
-		for index in range(0, llength):
+		for index in range(0, len(metrics)):
 			metrics_list.append(json.loads(metrics[index]))
+		if current and ((count <= 0) or (start + count > closed_count)) and (start <= closed_count):
+			metrics_list.append(_decode_metrics(current))
 		return(metrics_list)
 	
-	# Read current Metrics Record (i.e. top of the list)
-	return(json.loads(cmdsts.lindex('metrics:general', -1)))
+	# Read current Metrics Record
+	current = cmdsts.hgetall('metrics:current')
+	if not current:
+		return(default_metrics())
+	return(_decode_metrics(current))
+
+def read_metrics_count():
+	"""
+	Read the number of metrics records in the Redis DB
+
+	:return: Number of records (closed records plus the current record)
+	"""
+	global cmdsts
+
+	pipe = cmdsts.pipeline()
+	pipe.llen('metrics:general')
+	pipe.exists('metrics:current')
+	closed_count, current = pipe.execute()
+	return(closed_count + (1 if current else 0))
 
 def write_metrics(metrics=default_metrics(), flush=False, new_metric=False):
 	"""
@@ -857,29 +1169,54 @@ def write_metrics(metrics=default_metrics(), flush=False, new_metric=False):
 
 	:param metrics: Metrics Data
 	:param flush: True to clear metrics. False otherwise
-	:param new_metric:
+	:param new_metric: True to close the current record (append it to the list of closed records) and start a new 
+		record.  This is sent immediately (not queued in a write batch).
 	"""
 	global cmdsts
 
-	if(flush or not(cmdsts.exists('metrics:general'))):
+	if flush:
 		# Remove all metrics structures in Redis DB
-		cmdsts.delete('metrics:general')
+		cmdsts.delete('metrics:general', 'metrics:current')
 
 		# The following set's no persistence so that we don't get writes to the disk / SDCard 
 		cmdsts.config_set('appendonly', 'no')
 		cmdsts.config_set('save', '')
-		if not flush:
-			new_metric=True
-		else:
-			return
+		return
 
-	if new_metric:
+	if new_metric or not(cmdsts.exists('metrics:current')):
+		metrics = metrics.copy()
 		metrics['starttime'] = time.time() * 1000
 		metrics['id'] = generate_uuid()
-		cmdsts.rpush('metrics:general', json.dumps(metrics))
+
+		def _close_record(pipe):
+			current = pipe.hgetall('metrics:current')
+			pipe.multi()
+			if current:
+				pipe.rpush('metrics:general', json.dumps(_decode_metrics(current)))
+			pipe.delete('metrics:current')
+			pipe.hset('metrics:current', mapping=_encode_metrics(metrics))
+
+		cmdsts.transaction(_close_record, 'metrics:current')
 	else: 
-		cmdsts.rpop('metrics:general')
-		cmdsts.rpush('metrics:general', json.dumps(metrics))
+		_redis_writer().hset('metrics:current', mapping=_encode_metrics(metrics))
+
+def increment_metrics(key, amount):
+	"""
+	Add to a numeric field of the current metrics record (i.e. augerontime) without rewriting the record
+
+	:param key: Metrics field
+	:param amount: Amount to add
+	"""
+	_redis_writer().hincrbyfloat('metrics:current', key, amount)
+
+def _encode_metrics(metrics):
+	return { key : json.dumps(value) for key, value in metrics.items() }
+
+def _decode_metrics(fields):
+	metrics = default_metrics()
+	for key, value in fields.items():
+		metrics[key] = json.loads(value)
+	return(metrics)
 
 def read_settings(filename='settings.json', init=False, retry_count=0):
 	"""
@@ -889,11 +1226,33 @@ def read_settings(filename='settings.json', init=False, retry_count=0):
 	"""
 
 	try:
+		if filename == 'settings.json' and not init:
+			file_stat = os.stat(filename)
+			with settings_cache['lock']:
+				if settings_cache['key'] == (file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_size):
+					settings_cache['parses_avoided'] += 1
+					snapshot = settings_cache['snapshot']
+				else:
+					snapshot = None
+			if snapshot is not None:
+				return pickle.loads(snapshot)
+
 		json_data_file = os.fdopen(os.open(filename, os.O_RDONLY))
+		# Stat before reading, so that a write made while reading invalidates the snapshot 
+		file_stat = os.fstat(json_data_file.fileno())
 		json_data_string = json_data_file.read()
 		settings = json.loads(json_data_string)
 		json_data_file.close()
 
+		if filename == 'settings.json':
+			snapshot = pickle.dumps(settings, protocol=pickle.HIGHEST_PROTOCOL)
+			with settings_cache['lock']:
+				settings_cache['key'] = (file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_size)
+				settings_cache['snapshot'] = snapshot
+				settings_cache['sections'] = { key : [value, None] for key, value in settings.items() }
+				settings_cache['parses'] += 1
+			settings = pickle.loads(snapshot)  # Keep the parsed sections private
+
 	except(IOError, OSError):
 		""" Settings file not found, create a new default settings file """
 		settings = default_settings()
@@ -972,16 +1331,195 @@ def read_settings(filename='settings.json', init=False, retry_count=0):
 
 def write_settings(settings):
 	"""
-	Write all settings to JSON file
+	Write all settings to JSON file.  The file is only written if something other than 'lastupdated' has changed, 
+	and only the changed top level sections are serialized again.  The file is written to a temporary file, which 
+	then replaces settings.json, so that a concurrent read never sees a partially written file. 
 
 	:param settings: Settings
 
 	"""
+	with settings_cache['lock']:
+		_write_settings(settings)
+
+def _write_settings(settings):
+	_revalidate_settings_cache()
+	sections = settings_cache['sections']
+	changed = [key for key in settings if key != 'lastupdated' and (key not in sections or sections[key][0] != settings[key])]
+	if not changed and sections.keys() == settings.keys():
+		return
+
+	# Key paths that changed, relative to settings.json as it is on disk (revalidated above), so that the published 
+	#  changes bring the other process's settings up to the file that is written, even if this process's copy was stale 
+	changes = []
+	deleted = [[key] for key in sections if key not in settings]
+	for key in changed:
+		if key in sections:
+			_settings_diff(sections[key][0], settings[key], [key], changes, deleted)
+		else:
+			changes.append([[key], settings[key]])
+
 	settings['lastupdated']['time'] = math.trunc(time.time())
 
-	json_data_string = json.dumps(settings, indent=2, sort_keys=True)
-	with open("settings.json", 'w') as settings_file:
-		settings_file.write(json_data_string)
+	new_sections = {}
+	section_strings = []
+	for key in sorted(settings):
+		if key in changed or key == 'lastupdated':
+			# Keep a private copy of the section to compare against on the next write
+			section = [pickle.loads(pickle.dumps(settings[key], protocol=pickle.HIGHEST_PROTOCOL)), None]
+		else:
+			section = sections[key]
+		if section[1] is None:
+			section[1] = json.dumps(section[0], indent=2, sort_keys=True).replace('\n', '\n  ')
+		new_sections[key] = section
+		section_strings.append(f'  {json.dumps(key)}: {section[1]}')
+
+	# Same format as json.dumps(settings, indent=2, sort_keys=True)
+	json_data_string = '{\n' + ',\n'.join(section_strings) + '\n}' if section_strings else '{}'
+
+	temp_filename = f'.settings.json.{os.getpid()}.{threading.get_ident()}.tmp'  # Unique to the writing thread
+	try:
+		with open(temp_filename, 'w') as settings_file:
+			settings_file.write(json_data_string)
+			settings_file.flush()
+			os.fsync(settings_file.fileno())
+			file_stat = os.fstat(settings_file.fileno())
+		os.replace(temp_filename, 'settings.json')
+	except:
+		# Don't leave the partial temporary file behind
+		try:
+			os.unlink(temp_filename)
+		except OSError:
+			pass
+		raise
+
+	# The renamed file keeps its inode and mtime, so the snapshot is valid for it 
+	settings_cache['key'] = (file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_size)
+	settings_cache['snapshot'] = pickle.dumps(settings, protocol=pickle.HIGHEST_PROTOCOL)
+	settings_cache['sections'] = new_sections
+
+	try:
+		cmdsts.publish(SETTINGS_CHANNEL, json.dumps({ 'pid' : os.getpid(), 'changes' : changes, 'deleted' : deleted }))
+	except redis.RedisError:
+		pass  # The settings file is the source of truth, the other process will pick the changes up on its next read
+
+def _revalidate_settings_cache():
+	""" Read settings.json into the cache again if it was written (by the other process) since it was cached """
+	try:
+		file_stat = os.stat('settings.json')
+		if settings_cache['key'] == (file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_size):
+			return
+		with open('settings.json', 'r') as json_data_file:
+			file_stat = os.fstat(json_data_file.fileno())
+			settings = json.loads(json_data_file.read())
+		settings_cache['key'] = (file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_size)
+		settings_cache['snapshot'] = pickle.dumps(settings, protocol=pickle.HIGHEST_PROTOCOL)
+		settings_cache['sections'] = { key : [value, None] for key, value in settings.items() }
+		settings_cache['parses'] += 1
+	except (OSError, ValueError):
+		# Nothing readable to compare against, so every section is written
+		settings_cache['key'] = None
+		settings_cache['snapshot'] = None
+		settings_cache['sections'] = {}
+
+def _settings_diff(old, new, path, changes, deleted):
+	if isinstance(old, dict) and isinstance(new, dict):
+		for key, value in new.items():
+			if key not in old:
+				changes.append([path + [key], value])
+			elif old[key] != value:
+				_settings_diff(old[key], value, path + [key], changes, deleted)
+		for key in old:
+			if key not in new:
+				deleted.append(path + [key])
+	else:
+		changes.append([path, new])
+
+def subscribe_settings_changes():
+	"""
+	Subscribe to the settings change channel
+
+	:return: PubSub object subscribed to the settings change channel
+	"""
+	global cmdsts
+
+	listener = cmdsts.pubsub(ignore_subscribe_messages=True)
+	listener.subscribe(SETTINGS_CHANNEL)
+	return listener
+
+def read_settings_changes(listener):
+	"""
+	Read any pending settings change messages published by other processes (non-blocking)
+
+	:param listener: PubSub object from subscribe_settings_changes()
+	:return: Dictionary with the changed key paths and values ('changes') and deleted key paths ('deleted'), in the 
+		order they were published, or None if there were no changes (or the listener failed)
+	"""
+	result = None
+	try:
+		message = listener.get_message()
+		while message is not None:
+			data = json.loads(message['data'])
+			if data['pid'] != os.getpid():
+				if result is None:
+					result = { 'changes' : [], 'deleted' : [] }
+				result['changes'].extend(data['changes'])
+				result['deleted'].extend(data['deleted'])
+			message = listener.get_message()
+	except (redis.RedisError, ValueError, KeyError, TypeError):
+		pass
+	return result
+
+def apply_settings_changes(settings, settings_changes):
+	"""
+	Apply settings changes from read_settings_changes() to settings, in place
+
+	:param settings: Settings to patch
+	:param settings_changes: Changes from read_settings_changes()
+	:return: Set of the changed key paths (as tuples)
+	"""
+	changed_paths = set()
+	for path, value in settings_changes['changes']:
+		target = settings
+		for key in path[:-1]:
+			target = target.setdefault(key, {})
+		target[path[-1]] = value
+		changed_paths.add(tuple(path))
+	for path in settings_changes['deleted']:
+		target = settings
+		for key in path[:-1]:
+			target = target.get(key, {})
+		target.pop(path[-1], None)
+		changed_paths.add(tuple(path))
+	return changed_paths
+
+def settings_changed(changed_paths, *prefix):
+	"""
+	Check if any of the changed key paths is in (or contains) the settings under the prefix, 
+	i.e. settings_changed(changed_paths, 'cycle_data') 
+
+	:param changed_paths: Set of changed key paths from apply_settings_changes()
+	:param prefix: Key path prefix
+	:return: True if settings under the prefix changed
+	"""
+	return any(path[:len(prefix)] == prefix or prefix[:len(path)] == path for path in changed_paths)
+
+def patch_settings(patches):
+	"""
+	Apply key path patches to the settings and write them, i.e. patch_settings({ 'history_page.minutes' : 30 }).  Only 
+	the patched sections of the file are serialized again.   
+
+	:param patches: Dictionary of key paths ('.' separated) and their new values 
+	:return: Patched settings
+	"""
+	settings = read_settings()
+	for path, value in patches.items():
+		keys = path.split('.')
+		target = settings
+		for key in keys[:-1]:
+			target = target[key]
+		target[keys[-1]] = value
+	write_settings(settings)
+	return(settings)
 
 def backup_settings():
 	# Copy current settings file to a backup copy in /[BACKUP_PATH]/PiFire_[DATE]_[TIME].json 
@@ -1086,55 +1624,178 @@ def downgrade_settings(settings, settings_default):
 	write_log(warning)
 	return(settings)
 
-def read_pellet_db(filename='pelletdb.json'):
+def read_pellet_db(filename=None):
 	"""
-	Read Pellet DataBase from file
+	Read Pellet DataBase
 
-	:param filename: Filename to use (default pelletdb.json)
+	:param filename: JSON file to restore the database from (i.e. a backup file), or None to read the database
 	"""
-
-	pelletdb = default_pellets()
-
-	# Read all lines of pelletdb.json into a list(array)
-	try:
-		json_data_file = os.fdopen(os.open(filename, os.O_RDONLY))
-		json_data_string = json_data_file.read()
-		pelletdb_struct = json.loads(json_data_string)
-		json_data_file.close()
-	except(IOError, OSError):
-		# Issue with reading JSON, so create one/write new one
+	if filename is not None:
+		# Import a JSON pellet database (i.e. restore from a backup)
+		try:
+			json_data_file = os.fdopen(os.open(filename, os.O_RDONLY))
+			json_data_string = json_data_file.read()
+			pelletdb_struct = json.loads(json_data_string)
+			json_data_file.close()
+		except(IOError, OSError, ValueError):
+			write_log(f'An error occurred loading the pellet database from {filename}')
+			return(read_pellet_db())
+		pelletdb, update_db = _overlay_pellet_db(pelletdb_struct)
 		write_pellet_db(pelletdb)
 		return(pelletdb)
-	except:
-		''' Restore PelletDB from backup if available '''
-		pelletdb_struct = backup_pellet_db(action='restore')
-
-	# Overlay the read values over the top of the default values
-	#  This ensures that any NEW fields are captured.  
-	update_db = False # set flag in case an update needs to be written back
-
-	for key in pelletdb.keys():
-		if key in pelletdb_struct.keys():
-			pelletdb[key] = pelletdb_struct[key].copy()
-		else: 
-			update_db = True 
 
-	# If any of the keys were added or if restoring from file, then write back the changes 
-	if update_db or filename != 'pelletdb.json':
+	with pellet_db['lock']:
+		try:
+			connection = _pellet_db_connection()
+			data_version = connection.execute('PRAGMA data_version').fetchone()[0]
+			if (data_version == pellet_db['data_version']) and (pellet_db['snapshot'] is not None):
+				return pickle.loads(pellet_db['snapshot'])
+
+			stored = _load_pellet_db(connection)
+			pelletdb, update_db = _overlay_pellet_db(stored)
+			pellet_db['data_version'] = data_version
+			pellet_db['data'] = stored  # The database contents, so that the added keys are written back below
+			pellet_db['snapshot'] = pickle.dumps(pelletdb, protocol=pickle.HIGHEST_PROTOCOL)
+		except sqlite3.DatabaseError:
+			# Restore PelletDB from backup if available
+			_reset_pellet_db()
+			return(backup_pellet_db(action='restore'))
+
+	# If any of the keys were added, then write back the changes 
+	if update_db:
 		write_pellet_db(pelletdb)
 
-	return(pelletdb)
+	return pickle.loads(pellet_db['snapshot'])
 
 def write_pellet_db(pelletdb):
 	"""
-	Write Pellet DataBase to JSON file
+	Write Pellet DataBase, only updating the rows that changed
 
 	:param pelletdb: Pellet Database
 	"""
-	json_data_string = json.dumps(pelletdb, indent=2, sort_keys=True)
-	with open("pelletdb.json", 'w') as json_file:
+	with pellet_db['lock']:
+		connection = _pellet_db_connection()
+		connection.execute('BEGIN IMMEDIATE')
+		try:
+			data_version = connection.execute('PRAGMA data_version').fetchone()[0]
+			if (data_version != pellet_db['data_version']) or (pellet_db['data'] is None):
+				pellet_db['data'] = _load_pellet_db(connection)
+			_store_pellet_db(connection, pellet_db['data'], pelletdb)
+			connection.execute('COMMIT')
+		except:
+			connection.execute('ROLLBACK')
+			raise
+		pellet_db['data_version'] = connection.execute('PRAGMA data_version').fetchone()[0]
+		pellet_db['snapshot'] = pickle.dumps(pelletdb, protocol=pickle.HIGHEST_PROTOCOL)
+		pellet_db['data'] = pickle.loads(pellet_db['snapshot'])
+
+def export_pellet_db(filename):
+	"""
+	Export the Pellet DataBase to a JSON file (same format as the original pelletdb.json)
+
+	:param filename: JSON file to write
+	"""
+	json_data_string = json.dumps(read_pellet_db(), indent=2, sort_keys=True)
+	with open(filename, 'w') as json_file:
 		json_file.write(json_data_string)
 
+def delete_pellet_db():
+	"""
+	Reset the Pellet DataBase to defaults
+	"""
+	write_pellet_db(default_pellets())
+
+def _pellet_db_connection():
+	if pellet_db['connection'] is None:
+		connection = sqlite3.connect(PELLETDB_FILE, timeout=10, isolation_level=None, check_same_thread=False)
+		connection.execute('PRAGMA journal_mode=WAL')
+		connection.execute('PRAGMA synchronous=NORMAL')
+		connection.executescript(PELLETDB_SCHEMA)
+		pellet_db['connection'] = connection
+
+		# Populate a new database from the legacy JSON file (or the defaults)
+		imported = False
+		connection.execute('BEGIN IMMEDIATE')
+		try:
+			if connection.execute('PRAGMA user_version').fetchone()[0] == 0:
+				pelletdb_struct = read_generic_json(PELLETDB_JSON_FILE) if os.path.exists(PELLETDB_JSON_FILE) else {}
+				pelletdb, update_db = _overlay_pellet_db(pelletdb_struct)
+				_store_pellet_db(connection, {}, pelletdb)
+				connection.execute(f'PRAGMA user_version = {PELLETDB_SCHEMA_VERSION}')
+				imported = pelletdb_struct != {}
+			connection.execute('COMMIT')
+		except:
+			connection.execute('ROLLBACK')
+			raise
+		if imported:
+			# Retire the legacy file once its data is committed to the database
+			os.replace(PELLETDB_JSON_FILE, PELLETDB_JSON_IMPORTED_FILE)
+			write_log(f'Imported the pellet database from {PELLETDB_JSON_FILE} into {PELLETDB_FILE} (the JSON file was renamed to {PELLETDB_JSON_IMPORTED_FILE}).')
+	return pellet_db['connection']
+
+def _reset_pellet_db():
+	# Move a corrupted database out of the way, so that a new one is created on the next connection
+	if pellet_db['connection'] is not None:
+		pellet_db['connection'].close()
+	pellet_db['connection'] = None
+	pellet_db['data_version'] = None
+	pellet_db['data'] = None
+	pellet_db['snapshot'] = None
+	if os.path.exists(PELLETDB_FILE):
+		os.replace(PELLETDB_FILE, PELLETDB_FILE + '.corrupt')
+	for suffix in ['-wal', '-shm']:
+		if os.path.exists(PELLETDB_FILE + suffix):
+			os.remove(PELLETDB_FILE + suffix)
+	write_log(f'The pellet database was unreadable and was moved to {PELLETDB_FILE}.corrupt')
+
+def _overlay_pellet_db(pelletdb_struct):
+	# Overlay the read values over the top of the default values.  This ensures that any NEW fields are captured.  
+	pelletdb = default_pellets()
+	update_db = False # set flag in case an update needs to be written back
+	for key in pelletdb.keys():
+		if key in pelletdb_struct.keys():
+			pelletdb[key] = pelletdb_struct[key].copy()
+		else: 
+			update_db = True 
+	return pelletdb, update_db
+
+def _load_pellet_db(connection):
+	pelletdb = {}
+	pelletdb['current'] = { key : json.loads(value) for key, value in connection.execute('SELECT key, value FROM current') }
+	pelletdb['woods'] = [name for (name,) in connection.execute('SELECT name FROM woods ORDER BY position')]
+	pelletdb['brands'] = [name for (name,) in connection.execute('SELECT name FROM brands ORDER BY position')]
+	pelletdb['archive'] = { pelletid : json.loads(profile) for pelletid, profile in connection.execute('SELECT id, profile FROM archive') }
+	pelletdb['log'] = dict(connection.execute('SELECT date_loaded, pelletid FROM log ORDER BY date_loaded'))
+	for key, value in connection.execute('SELECT key, value FROM sections'):
+		pelletdb[key] = json.loads(value)
+	return pelletdb
+
+def _store_pellet_db(connection, old, new):
+	# Write the rows that differ between old (the database contents) and new
+	_store_pellet_rows(connection, 'current', 'key', old.get('current', {}), new.get('current', {}), 
+		lambda key, value: (key, json.dumps(value)))
+	for table in ['woods', 'brands']:
+		if old.get(table, None) != new.get(table, []):
+			connection.execute(f'DELETE FROM {table}')
+			connection.executemany(f'INSERT OR IGNORE INTO {table} (name, position) VALUES (?, ?)', 
+				[(name, position) for position, name in enumerate(new.get(table, []))])
+	_store_pellet_rows(connection, 'archive', 'id', old.get('archive', {}), new.get('archive', {}), 
+		lambda key, value: (key, value.get('brand', ''), value.get('wood', ''), json.dumps(value)))
+	_store_pellet_rows(connection, 'log', 'date_loaded', old.get('log', {}), new.get('log', {}), 
+		lambda key, value: (key, value))
+	tables = ['current', 'woods', 'brands', 'archive', 'log']
+	_store_pellet_rows(connection, 'sections', 'key', { key : value for key, value in old.items() if key not in tables }, 
+		{ key : value for key, value in new.items() if key not in tables }, lambda key, value: (key, json.dumps(value)))
+
+def _store_pellet_rows(connection, table, key_column, old_rows, new_rows, row_values):
+	changed = [row_values(key, value) for key, value in new_rows.items() if (key not in old_rows) or (old_rows[key] != value)]
+	removed = [(key,) for key in old_rows if key not in new_rows]
+	if changed:
+		placeholders = ', '.join(['?'] * len(changed[0]))
+		connection.executemany(f'INSERT OR REPLACE INTO {table} VALUES ({placeholders})', changed)
+	if removed:
+		connection.executemany(f'DELETE FROM {table} WHERE {key_column} = ?', removed)
+
 def backup_pellet_db(action='backup'):
 	''' Backup & Restore Pellet Database '''
 	backup_manifest = read_generic_json('./backups/manifest.json')
@@ -1155,7 +1816,7 @@ def backup_pellet_db(action='backup'):
 		time_now = datetime.datetime.now()
 		time_str = time_now.strftime('%m-%d-%y_%H%M%S') # Truncate the microseconds
 		backup_file = BACKUP_PATH + 'PelletDB_' + time_str + '.json'
-		os.system(f'cp pelletdb.json {backup_file}')
+		export_pellet_db(backup_file)
 		backup_manifest['pelletdb']['current'] = backup_file 
 		message = f'Pellet DB has been backed up to the following file: {backup_file}'
 		write_generic_json(backup_manifest, './backups/manifest.json')
@@ -1167,7 +1828,6 @@ def backup_pellet_db(action='backup'):
 			pelletdb_backup_file = backup_pelletdb
 			warning = f'There was an issue with loading the Pellet Database (possibly corruption).  Restoring from the following backup file: {backup_pelletdb}.'
 			pelletdb = read_pellet_db(filename=pelletdb_backup_file)
-			write_pellet_db(pelletdb)
 		else: 
 			warning = f'There was an issue with loading the Pellet Database (possibly corruption).  No backups found, setting to defaults.'
 			pelletdb = default_pellets()
@@ -1180,36 +1840,35 @@ def backup_pellet_db(action='backup'):
 
 	return 
 
-def read_events(legacy=True):
+def read_events(legacy=True, max_events=0):
 	"""
 	Read event.log and populate an array of events.
 
+	:param max_events: Read only the newest max_events events (0 to read all events)
+
 	if legacy=true:
-	:return: (event_list, num_events)
+	:return: (event_list, num_events), newest event first
 
 	if legacy=false:
-	:return: (event_list, num_events)
+	:return: event_list, oldest event first
 	"""
-	# Read all lines of events.log into a list(array)
-	try:
-		with open('/tmp/events.log') as event_file:
-			event_lines = event_file.readlines()
-			event_file.close()
 	# If file not found error, then create events.log file
-	except(IOError, OSError):
+	if not os.path.exists('/tmp/events.log'):
 		event_file = open('/tmp/events.log', "w")
 		event_file.close()
-		event_lines = []
 
-	# Initialize event_list list
-	event_list = []
+	if max_events > 0:
+		event_lines = read_log_tail('/tmp/events.log', max_events)
+	else:
+		event_lines = read_log_file('/tmp/events.log')
+
+	event_list = [line.split(" ",2) for line in event_lines]
 
 	# Get number of events
-	num_events = len(event_lines)
+	num_events = len(event_list)
 
 	if legacy:
-		for x in range(num_events):
-			event_list.insert(0, event_lines[x].split(" ",2))
+		event_list.reverse()
 
 		# Error handling if number of events is less than 10, fill array with empty
 		if num_events < 10:
@@ -1217,8 +1876,6 @@ def read_events(legacy=True):
 				event_list.append(["--------","--:--:--","---"])
 			num_events = 10
 	else:
-		for x in range(num_events):
-			event_list.append(event_lines[x].split(" ",2))
 		return event_list
 
 	return(event_list, num_events)
@@ -1237,6 +1894,94 @@ def read_log_file(filepath):
 
 	return log_file_lines 
 
+def read_log_tail(filepath, count):
+	"""
+	Read the last lines of a log file, reading backwards from the end of the file
+
+	:param filepath: Log file
+	:param count: Number of lines to read
+	:return: List of lines, oldest first
+	"""
+	try:
+		with open(filepath, 'rb') as log_file:
+			position = log_file.seek(0, os.SEEK_END)
+			data = b''
+			# Read blocks from the end until there are more than count line breaks (or the start of the file)
+			while position > 0 and data.count(b'\n') <= count:
+				block_size = min(LOG_READ_BLOCK, position)
+				position -= block_size
+				log_file.seek(position)
+				data = log_file.read(block_size) + data
+	except(IOError, OSError):
+		event = f'Unable to open log file: {filepath}'
+		write_log(event)
+		return []
+
+	lines = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+	if position > 0:
+		lines = lines[1:]  # The first line is incomplete
+	return lines[-count:] if count > 0 else []
+
+def count_log_lines(filepath):
+	"""
+	Get the number of lines in a log file (updating the line offset index)
+
+	:param filepath: Log file
+	:return: Number of lines
+	"""
+	index = _log_index(filepath)
+	return index['lines'] if index is not None else 0
+
+def read_log_lines(filepath, start, count):
+	"""
+	Read a range of lines from a log file, seeking to the nearest indexed line
+
+	:param filepath: Log file
+	:param start: Index of the first line to read
+	:param count: Number of lines to read
+	:return: List of lines
+	"""
+	index = _log_index(filepath)
+	if index is None or start >= index['lines'] or count <= 0:
+		return []
+	count = min(count, index['lines'] - start)
+
+	lines = []
+	with open(filepath, 'rb') as log_file:
+		log_file.seek(index['offsets'][start // LOG_INDEX_STRIDE])
+		for line_number in range((start // LOG_INDEX_STRIDE) * LOG_INDEX_STRIDE, start + count):
+			line = log_file.readline()
+			if line_number >= start:
+				lines.append(line.decode('utf-8', errors='replace'))
+	return lines
+
+def _log_index(filepath):
+	# Get the line offset index for a log file, indexing only the part of the file added since it was last indexed
+	try:
+		with open(filepath, 'rb') as log_file:
+			stat = os.fstat(log_file.fileno())
+			index = log_indexes.get(filepath, None)
+			if (index is None) or (index['inode'] != stat.st_ino) or (stat.st_size < index['size']):
+				# New file, or the file was rotated / truncated
+				index = { 'inode' : stat.st_ino, 'size' : 0, 'lines' : 0, 'offsets' : [0] }
+				log_indexes[filepath] = index
+			if stat.st_size > index['size']:
+				log_file.seek(index['size'])
+				offset = index['size']
+				for line in log_file:
+					if not line.endswith(b'\n'):
+						break  # Leave a partially written line for the next update
+					offset += len(line)
+					index['lines'] += 1
+					if index['lines'] % LOG_INDEX_STRIDE == 0:
+						index['offsets'].append(offset)
+				index['size'] = offset
+	except(IOError, OSError):
+		event = f'Unable to open log file: {filepath}'
+		write_log(event)
+		return None
+	return index
+
 def add_line_numbers(event_list):
 	event_lines = []
 	for index, line in enumerate(event_list):
@@ -1249,9 +1994,19 @@ def write_log(event):
 
 	:param event: String event
 	"""
-	log_level = logging.INFO
-	eventLogger = create_logger('events', filename='/tmp/events.log', messageformat='%(asctime)s [%(levelname)s] %(message)s', level=log_level)
-	eventLogger.info(event)
+	get_event_logger().info(event)
+
+def get_event_logger(level=logging.INFO):
+	"""
+	Get the 'events' logger (writing to /tmp/events.log), creating it the first time
+
+	:param level: Log level, if the logger is created by this call
+	"""
+	global event_logger
+
+	if event_logger is None:
+		event_logger = create_logger('events', filename='/tmp/events.log', messageformat=EVENT_LOG_FORMAT, level=level)
+	return event_logger
 
 def write_event(settings, event):
 	"""
@@ -1267,13 +2022,19 @@ def write_event(settings, event):
 	elif not event.startswith('*'):
 		write_log(event)
 
-def read_history(num_items=0, flushhistory=False):
+def read_history(num_items=0, flushhistory=False, data_points=0, start_ms=None, end_ms=None, columns=False):
 	"""
 	Read history from Redis DB and populate a list of data
 
-	:param num_items: Items from end of the history (set to 0 for all items)
+	:param num_items: Items from end of the history (set to 0 for all items, ignored if a time range is given)
 	:param flushhistory: True=flush history & current, False=normal history read
-	:return: List of history dictionaries (each list item is timestamped 'T')
+	:param data_points: If set, read from the coarsest downsampled tier that still provides this many data points 
+		(falls back to the raw samples if no tier is coarse enough)
+	:param start_ms: Start of the time range to read (timestamp in ms, inclusive), or None for no lower bound
+	:param end_ms: End of the time range to read (timestamp in ms, inclusive), or None for no upper bound
+	:param columns: True to return the history unpacked into columns (see unpack_history())
+	:return: List of history dictionaries (each list item is timestamped 'T'), or the history columns if columns=True 
+		(an empty list if there is no history)
 	"""
 	global cmdsts
 	
@@ -1281,48 +2042,333 @@ def read_history(num_items=0, flushhistory=False):
 
 	# If a flushhistory is requested, then flush the control:history key (and data)
 	if flushhistory:
+		history_rollup['buckets'].clear()
+		history_rollup['generation'] = str(cmdsts.incr('control:history:generation'))
+		cmdsts.delete(*[f'control:history:{tier}' for tier in HISTORY_TIERS])  # deletes the downsampled tiers
 		if cmdsts.exists('control:history'):
 			cmdsts.delete('control:history')  # deletes the history
 			read_current(zero_out=True)  # zero-out current data
 			write_metrics(flush=True)
+		return(datalist)
+
+	time_range = start_ms is not None or end_ms is not None
+	min_score = start_ms if start_ms is not None else '-inf'
+	max_score = end_ms if end_ms is not None else '+inf'
+
+	if data_points > 0 and (time_range or num_items > 0):
+		for tier in reversed(list(HISTORY_TIERS)):
+			# Skip tiers that are too coarse for the request, or that haven't collected enough buckets yet
+			if time_range:
+				enough_buckets = cmdsts.zcount(f'control:history:{tier}', min_score, max_score) >= data_points
+			else:
+				enough_buckets = num_items // HISTORY_TIERS[tier]['factor'] >= data_points and \
+					cmdsts.zcard(f'control:history:{tier}') >= data_points
+			if enough_buckets:
+				datalist = _read_history_tier(tier, num_items, min_score, max_score, time_range)
+				return unpack_history(datalist) if (columns and datalist) else datalist
+
+	if time_range:
+		data = cmdsts.zrangebyscore('control:history', min_score, max_score)
 	else:
-		if cmdsts.exists('control:history'):
-			list_length = cmdsts.llen('control:history') 
+		data = cmdsts.zrange('control:history', -num_items if num_items > 0 else 0, -1)
 
-			if((num_items > 0) and (list_length < num_items)) or (num_items == 0):
-				list_start = 0
-			else: 
-				list_start = list_length - num_items
+	if columns:
+		return _unpack_history_entries(data) if data else []
 
-			data = cmdsts.lrange('control:history', list_start, -1)
-			
-			''' Unpack data to list of dictionaries '''
-			for index in range(len(data)):
-				datalist.append(json.loads(data[index]))
+	''' Unpack data to list of dictionaries '''
+	datalist = _decode_history(data)
 			
 	return(datalist)
 
+def _read_history_tier(tier, num_items, min_score, max_score, time_range):
+	"""
+	Read a downsampled history tier, either for a time range or covering (approximately) the last num_items raw 
+	samples.  Raw samples newer than the last closed bucket are appended, so that the end of the chart stays current.  
+
+	:param tier: Tier name (key in HISTORY_TIERS)
+	:param num_items: Number of raw samples to cover (if no time range is given)
+	:param min_score: Start of the time range (ms or '-inf')
+	:param max_score: End of the time range (ms or '+inf')
+	:param time_range: True if the time range should be used instead of num_items
+	:return: List of history dictionaries
+	"""
+	if time_range:
+		buckets = cmdsts.zrangebyscore(f'control:history:{tier}', min_score, max_score)
+	else:
+		buckets = cmdsts.zrange(f'control:history:{tier}', -(num_items // HISTORY_TIERS[tier]['factor']), -1)
+
+	datalist = [json.loads(bucket) for bucket in buckets]
+	if datalist:
+		# Samples in the last bucket period have not been rolled up yet
+		min_score = datalist[-1]['T'] + HISTORY_TIERS[tier]['period']
+	recent = cmdsts.zrangebyscore('control:history', min_score, max_score)
+
+	for datastruct in _decode_history(recent):
+		# Raw samples are their own min / max
+		datastruct['MIN'] = { **datastruct['P'], **datastruct['F'], **datastruct['AUX'] }
+		datastruct['MAX'] = dict(datastruct['MIN'])
+		datastruct['N'] = 1
+		datalist.append(datastruct)
+
+	return datalist
+
+def _rollup_history(datastruct, writer):
+	"""
+	Add a history sample to the open bucket of each downsampled tier, and write out any bucket that the sample closes. 
+
+	:param datastruct: History dictionary
+	:param writer: Redis client or pipeline to write the closed buckets to
+	"""
+	labels = tuple((group, tuple(datastruct[group])) for group in HISTORY_GROUPS if group in datastruct)
+
+	# Drop the open buckets if the history was flushed (by any process) since they were opened
+	generation = cmdsts.get('control:history:generation')
+	if generation != history_rollup['generation']:
+		history_rollup['buckets'].clear()
+		history_rollup['generation'] = generation
+
+	for tier, tier_info in HISTORY_TIERS.items():
+		start = datastruct['T'] - (datastruct['T'] % tier_info['period'])
+		bucket = history_rollup['buckets'].get(tier)
+
+		# Close the open bucket when the sample is in a new period (or the probe layout changed)
+		if bucket is not None and (bucket['T'] != start or bucket['labels'] != labels):
+			writer.zadd(f'control:history:{tier}', { json.dumps(_close_history_bucket(bucket)) : bucket['T'] })
+			writer.zremrangebyrank(f'control:history:{tier}', 0, -(tier_info['maxsizelines'] + 1))
+			bucket = None
+
+		if bucket is None:
+			bucket = { 'T' : start, 'labels' : labels, 'N' : 0, 'stats' : {} }
+			history_rollup['buckets'][tier] = bucket
+
+		bucket['N'] += 1
+		bucket['PSP'] = datastruct['PSP']
+		bucket['NT'] = dict(datastruct['NT'])
+		for group, keys in labels:
+			if group == 'NT':
+				continue
+			for key in keys:
+				value = datastruct[group][key]
+				if not isinstance(value, (int, float)):
+					continue
+				stats = bucket['stats'].setdefault((group, key), [0.0, 0, value, value])  # [sum, count, min, max]
+				stats[0] += value
+				stats[1] += 1
+				stats[2] = min(stats[2], value)
+				stats[3] = max(stats[3], value)
+
+def _close_history_bucket(bucket):
+	"""
+	Build the stored form of a downsampled history bucket
+
+	:param bucket: Open bucket accumulator
+	:return: History dictionary with the bucket mean values, plus 'MIN', 'MAX' and 'N'
+	"""
+	datastruct = { 'T' : bucket['T'], 'PSP' : bucket['PSP'] }
+	minimum = {}
+	maximum = {}
+	for group, keys in bucket['labels']:
+		if group == 'NT':
+			datastruct['NT'] = bucket['NT']
+			continue
+		datastruct[group] = {}
+		for key in keys:
+			stats = bucket['stats'].get((group, key))
+			datastruct[group][key] = round(stats[0] / stats[1], 2) if stats else None
+			if group in ['P', 'F', 'AUX']:
+				minimum[key] = stats[2] if stats else None
+				maximum[key] = stats[3] if stats else None
+	datastruct['MIN'] = minimum
+	datastruct['MAX'] = maximum
+	datastruct['N'] = bucket['N']
+	return datastruct
+
+def _history_schema(schema_id):
+	"""
+	Get a history schema, fetching the schema hash from the Redis DB if the schema is not already cached
+
+	:param schema_id: Schema ID
+	:return: Schema dictionary (groups and struct), or None if the schema is unknown
+	"""
+	global cmdsts
+
+	if schema_id not in history_schemas:
+		for key, layout_string in cmdsts.hgetall('control:history:schema').items():
+			layout = json.loads(layout_string)
+			if layout.get('version', None) != HISTORY_SCHEMA_VERSION:
+				continue
+			num_values = sum(len(labels) for group, labels in layout['groups'])
+			history_schemas[key] = {
+				'groups' : layout['groups'],
+				'struct' : struct.Struct('<qd' + ('d' * num_values))
+			}
+	return history_schemas.get(schema_id, None)
+
+def _decode_history(data):
+	"""
+	Decode history samples read from the Redis DB (compact or legacy JSON)
+
+	:param data: List of encoded samples
+	:return: List of history dictionaries
+	"""
+	datalist = []
+	for entry in data:
+		if entry[0] == '{':
+			datalist.append(json.loads(entry))
+			continue
+		schema_id, payload = entry[1:].split('|', 1)
+		schema = _history_schema(schema_id)
+		if schema is None:
+			continue  # Schema was lost (i.e. Redis was restarted), so the sample can't be decoded
+		values = schema['struct'].unpack(base64.b64decode(payload))
+		# Restore integer values (i.e. temperatures in F), which are packed as floats
+		datastruct = { 'T' : values[0] }
+		values = [int(value) if value.is_integer() else value for value in values[1:]]
+		datastruct['PSP'] = values[0]
+		index = 1
+		for group, labels in schema['groups']:
+			datastruct[group] = dict(zip(labels, values[index:index + len(labels)]))
+			index += len(labels)
+		datalist.append(datastruct)
+	return datalist
+
+def _encode_history(datastruct):
+	"""
+	Encode a history sample in the compact format.  Falls back to JSON if the sample can't be packed.
+
+	:param datastruct: History dictionary
+	:return: Encoded sample
+	"""
+	try:
+		labels = tuple((group, tuple(datastruct[group])) for group in HISTORY_GROUPS if group in datastruct)
+		if labels != history_encoder['labels']:
+			layout_string = json.dumps({ 'version' : HISTORY_SCHEMA_VERSION, 'groups' : labels })
+			history_encoder['labels'] = labels
+			history_encoder['id'] = format(zlib.crc32(layout_string.encode()), '08x')
+			history_encoder['layout'] = layout_string
+			history_encoder['struct'] = struct.Struct('<qd' + ('d' * sum(len(keys) for group, keys in labels)))
+
+		values = [datastruct['T'], datastruct['PSP']]
+		for group, keys in labels:
+			values.extend(datastruct[group].values())
+		packed = history_encoder['struct'].pack(*values)
+	except (struct.error, TypeError, AttributeError):
+		return json.dumps(datastruct)
+
+	return f'~{history_encoder["id"]}|{base64.b64encode(packed).decode()}'
+
 def unpack_history(datalist):
-	temp_dict = {}  # Create temporary dictionary to store all of the history data lists
+	"""
+	Unpack a list of history dictionaries into columns (one column per key / probe), in a single pass. 
+
+	Numeric columns are stored in arrays ('T' as int64, everything else as float64, with None stored as NaN) and 
+	returned as NumPy arrays if NumPy is installed, otherwise as memoryviews of the arrays, so that slicing a column 
+	does not copy it.  Columns with non-numeric values (i.e. extended data) are plain lists.  Use 
+	history_column_values() to get a JSON-serializable list from a column. 
+
+	:param datalist: List of history dictionaries
+	:return: Dictionary of columns ('T', 'PSP', ...) and of dictionaries of columns ('P', 'F', 'NT', ...)
+	"""
+	temp_dict = {}  # Create temporary dictionary to store all of the history data columns
 	temp_struct = datalist[0]  # Load the initial history data into a temporary dictionary  
-	for key in temp_struct.keys():  # Iterate each of the keys
-		if key in ['P', 'F', 'NT', 'EXD', 'AUX']:
-			temp_dict[key] = {}
-			for subkey in temp_struct[key]:
-				temp_dict[key][subkey] = []
+	for key, value in temp_struct.items():  # Iterate each of the keys
+		if key == 'EXD':
+			temp_dict[key] = { subkey : [] for subkey in value }  # Extended data can hold any type of value
+		elif isinstance(value, dict):
+			temp_dict[key] = { subkey : array('d') for subkey in value }
 		else: 
-			temp_dict[key] = []  # Create an empty list for any other keys ('T', 'PSP')
+			temp_dict[key] = array('q') if key == 'T' else array('d')  # Create an empty column for any other keys ('T', 'PSP')
 
-	for index in range(len(datalist)):
-		temp_struct = datalist[index]
+	for temp_struct in datalist:
 		for key, value in temp_struct.items():
-			if key in ['P', 'F', 'NT', 'EXD', 'AUX']:
-				for subkey, subvalue in temp_struct[key].items():
-					temp_dict[key][subkey].append(subvalue)
+			columns = temp_dict[key]
+			if isinstance(value, dict):
+				for subkey, subvalue in value.items():
+					try:
+						columns[subkey].append(math.nan if subvalue is None else subvalue)
+					except TypeError:
+						# Non-numeric value, fall back to a list for this column
+						columns[subkey] = _history_column_to_list(columns[subkey])
+						columns[subkey].append(subvalue)
 			else: 
-				temp_dict[key].append(value)  # Append list for any other keys ('T', 'PSP')
+				try:
+					columns.append(math.nan if value is None else value)
+				except TypeError:
+					temp_dict[key] = _history_column_to_list(columns)
+					temp_dict[key].append(value)
+
+	for key, value in temp_dict.items():
+		if isinstance(value, dict):
+			for subkey in value:
+				value[subkey] = _history_column_view(value[subkey])
+		else:
+			temp_dict[key] = _history_column_view(value)
+	return temp_dict
+
+def _unpack_history_entries(data):
+	"""
+	Unpack encoded history samples straight into columns.  When all of the samples are compact samples with the same 
+	schema (the normal case), the packed values are joined into one buffer and each column is a strided view of it, 
+	without building a dictionary per sample.  Otherwise the samples are decoded and unpacked with unpack_history(). 
+
+	:param data: List of encoded samples
+	:return: History columns
+	"""
+	prefix = data[0][:data[0].find('|') + 1]
+	schema = _history_schema(prefix[1:-1]) if data[0][0] == '~' else None
+	if (schema is None) or (sys.byteorder != 'little') or not all(entry.startswith(prefix) for entry in data):
+		return unpack_history(_decode_history(data))
+
+	payload = b''.join([base64.b64decode(entry[len(prefix):]) for entry in data])
+	width = schema['struct'].size // 8
+	if np is not None:
+		values = np.frombuffer(payload, dtype='<f8').reshape(-1, width)
+		temp_dict = { 'T' : np.frombuffer(payload, dtype='<i8')[0::width], 'PSP' : values[:, 1] }
+		column = lambda index: values[:, index]
+	else:
+		values = memoryview(payload).cast('d')
+		temp_dict = { 'T' : memoryview(payload).cast('q')[0::width], 'PSP' : values[1::width] }
+		column = lambda index: values[index::width]
+
+	index = 2
+	for group, labels in schema['groups']:
+		temp_dict[group] = {}
+		for label in labels:
+			temp_dict[group][label] = column(index)
+			index += 1
 	return temp_dict
 
+def _history_column_view(column):
+	if not isinstance(column, array):
+		return column
+	if np is not None:
+		return np.frombuffer(column, dtype=np.int64 if column.typecode == 'q' else np.float64)
+	return memoryview(column)
+
+def _history_column_to_list(column):
+	return [None if value != value else value for value in column]  # NaN -> None
+
+def history_column_values(column, indices=None):
+	"""
+	Get a list of values from a history column (see unpack_history()), with NaN values replaced by None 
+
+	:param column: History column (NumPy array, memoryview or list)
+	:param indices: range or list of indices to select (None for all values)
+	:return: List of values
+	"""
+	if isinstance(indices, range):
+		column = column[indices.start:indices.stop:indices.step]  # No copy for arrays / memoryviews
+	elif indices is not None:
+		column = column[list(indices)] if (np is not None and isinstance(column, np.ndarray)) else [column[index] for index in indices]
+
+	if isinstance(column, list):
+		return [None if value != value else value for value in column]
+
+	values = column.tolist()
+	if (column.dtype.kind == 'i') if (np is not None and isinstance(column, np.ndarray)) else (column.format == 'q'):
+		return values  # Timestamps, never NaN
+	return [None if value != value else value for value in values]
+
 def write_history(in_data, maxsizelines=28800, ext_data=False):
 	"""
 	Write History to Redis DB
@@ -1346,12 +2392,21 @@ def write_history(in_data, maxsizelines=28800, ext_data=False):
 	if ext_data:
 		datastruct['EXD'] = in_data['ext_data']
 
-	# Push data string to the list in the last position
-	cmdsts.rpush('control:history', json.dumps(datastruct))
+	writer = _redis_writer()
+
+	entry = _encode_history(datastruct)
+	if entry[0] != '{':
+		# Make sure the schema for the sample is stored (no-op if it already exists)
+		writer.hsetnx('control:history:schema', history_encoder['id'], history_encoder['layout'])
 
-	# Check if the list has exceeded maxsizelines, and pop the first item from the list if it has
-	if cmdsts.llen('control:history') > maxsizelines:
-		cmdsts.lpop('control:history')
+	# Add the sample to the sorted set, scored by its timestamp 
+	writer.zadd('control:history', { entry : datastruct['T'] })
+
+	# Trim the set to the last maxsizelines items, dropping the oldest items if it has grown past the limit
+	writer.zremrangebyrank('control:history', 0, -(maxsizelines + 1))
+
+	# Update the downsampled tiers
+	_rollup_history(datastruct, writer)
 
 
 def write_current(in_data):
@@ -1367,7 +2422,7 @@ def write_current(in_data):
 	current['F'] = in_data['probe_history']['food']
 	current['PSP'] = in_data['primary_setpoint']
 	current['NT'] = in_data['notify_targets']
-	cmdsts.set('control:current', json.dumps(current))
+	_redis_writer().set('control:current', json.dumps(current))
 
 def read_current(zero_out=False):
 	"""
@@ -1410,7 +2465,7 @@ def write_tr(tr_data):
 
 	"""
 	global cmdsts
-	cmdsts.set('control:tuning', json.dumps(tr_data))
+	_redis_writer().set('control:tuning', json.dumps(tr_data))
 
 def read_tr():
 	"""
@@ -1795,7 +2850,28 @@ def write_status(status):
 	"""
 	global cmdsts
 
-	cmdsts.set('control:status', json.dumps(status))
+	_redis_writer().set('control:status', json.dumps(status))
+
+def write_loop_stats(loop_stats):
+	"""
+	Write the control loop statistics (stage timing percentiles) to Redis DB
+
+	:param loop_stats: Loop Statistics Dictionary
+	"""
+	global cmdsts
+
+	_redis_writer().set('control:loopstats', json.dumps(loop_stats))
+
+def read_loop_stats():
+	"""
+	Read the control loop statistics from Redis DB
+
+	:return: Loop Statistics Dictionary (empty if the control loop has not published any yet)
+	"""
+	global cmdsts
+
+	loop_stats = cmdsts.get('control:loopstats')
+	return json.loads(loop_stats) if loop_stats is not None else {}
 
 def read_status(init=False):
 	"""
@@ -1819,6 +2895,7 @@ def read_status(init=False):
 			"lid_open_endtime": 0,
 			"p_mode": 0,
 			"recipe_paused": False,
+			"stale_probe_devices": {},
 			"outpins": {
 				"auger": False,
 				"fan": False,
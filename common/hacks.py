@@ -2,7 +2,7 @@
 Hacks to convert certain APIs / Formats to PiFire v1.3.5 format to maintain compatibility with the current Android App
 '''
 import datetime
-from common import read_control, write_control, read_settings, write_settings, read_history, read_current, unpack_history
+from common import read_control, write_control, read_settings, write_settings, read_history, read_current, history_column_values
 
 def hack_read_settings():
 	settings = read_settings()
@@ -234,25 +234,33 @@ def hack_prepare_data(num_items=10, reduce=True, data_points=60):
 	settings = read_settings()
 	units = settings['globals']['units']
 
-	data_struct = read_history(num_items)
-
-	unpacked_history = unpack_history(data_struct)
+	unpacked_history = read_history(num_items, columns=True)
 
 	list_length = len(unpacked_history['T']) # Length of list(s)
 
+	if ((list_length < num_items) and (list_length > 0)) or (num_items == 0):
+		num_items = list_length
+
+	# Select the items to send from the history columns
+	if reduce and (num_items > data_points):
+		indices = range(list_length - num_items, list_length, int(num_items/data_points))
+	else:
+		indices = range(list_length - num_items, list_length)
+	list_length = len(indices)
+
 	data_blob = {}
 
-	data_blob['label_time_list'] = unpacked_history['T']
+	data_blob['label_time_list'] = history_column_values(unpacked_history['T'], indices)
 
 	grill_key = list(unpacked_history['P'].keys())[0]
-	data_blob['grill_temp_list'] = unpacked_history['P'][grill_key]
-	data_blob['grill_settemp_list'] = unpacked_history['PSP']
+	data_blob['grill_temp_list'] = history_column_values(unpacked_history['P'][grill_key], indices)
+	data_blob['grill_settemp_list'] = history_column_values(unpacked_history['PSP'], indices)
 
 	probe1_key = ''
 	if len(list(unpacked_history['F'].keys())) > 0:
 		probe1_key = list(unpacked_history['F'].keys())[0]
-		data_blob['probe1_temp_list'] = unpacked_history['F'][probe1_key]
-		data_blob['probe1_settemp_list'] = unpacked_history['NT'][probe1_key]
+		data_blob['probe1_temp_list'] = history_column_values(unpacked_history['F'][probe1_key], indices)
+		data_blob['probe1_settemp_list'] = history_column_values(unpacked_history['NT'][probe1_key], indices)
 	else:
 		data_blob['probe1_temp_list'] = []
 		data_blob['probe1_settemp_list'] = []
@@ -263,8 +271,8 @@ def hack_prepare_data(num_items=10, reduce=True, data_points=60):
 	probe2_key = ''
 	if len(list(unpacked_history['F'].keys())) > 1:
 		probe2_key = list(unpacked_history['F'].keys())[1] 
-		data_blob['probe2_temp_list'] = unpacked_history['F'][probe2_key]
-		data_blob['probe2_settemp_list'] = unpacked_history['NT'][probe2_key]
+		data_blob['probe2_temp_list'] = history_column_values(unpacked_history['F'][probe2_key], indices)
+		data_blob['probe2_settemp_list'] = history_column_values(unpacked_history['NT'][probe2_key], indices)
 	else:
 		data_blob['probe2_temp_list'] = []
 		data_blob['probe2_settemp_list'] = []
@@ -272,17 +280,6 @@ def hack_prepare_data(num_items=10, reduce=True, data_points=60):
 			data_blob['probe2_temp_list'].append(0)
 			data_blob['probe2_settemp_list'].append(0)
 
-	if (list_length < num_items) and (list_length > 0):
-		num_items = list_length
-
-	if reduce and (num_items > data_points):
-		step = int(num_items/data_points)
-		temp_blob = data_blob.copy()
-		data_blob = {}
-		for key, value in temp_blob.items():
-			for index in range(list_length - num_items, list_length, step):
-				data_blob[key].append(temp_blob[key][index])
-
 	if (list_length == 0):
 		now = datetime.datetime.now()
 		#time_now = now.strftime('%H:%M:%S')
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+'''
+==============================================================================
+ PiFire Control Loop Statistics
+==============================================================================
+
+Description: Per-stage latency instrumentation for the control work cycle.
+	Each stage (i.e. probe reads, Redis writes) is timed with the performance
+	counter, and the durations are kept in a rolling window per stage.  When
+	the statistics are summarized (i.e. every few seconds, for publishing to
+	Redis), the percentiles and a histogram of the window are calculated.
+
+	Timing a stage costs two perf_counter() calls and a deque append, so the
+	instrumentation can be left on in production.
+
+	Usage:
+
+		loop_stats = LoopStats(['probes', 'redis'])
+		with loop_stats.stage('probes'):
+			sensor_data = probe_complex.read_probes()
+
+==============================================================================
+'''
+
+'''
+==============================================================================
+ Imported Modules
+==============================================================================
+'''
+import time
+import bisect
+from collections import deque
+
+'''
+==============================================================================
+ Constants
+==============================================================================
+'''
+# Histogram bucket upper bounds in milliseconds (the last bucket counts everything above the last bound)
+HISTOGRAM_BOUNDS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+PERCENTILES = [50, 90, 99]
+
+'''
+==============================================================================
+ Class Definitions
+==============================================================================
+'''
+
+class _StageTimer:
+	''' Context manager that adds the time spent in the block to a stage window '''
+	def __init__(self, window):
+		self.window = window
+		self.start = 0.0
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.window.append(time.perf_counter() - self.start)
+		return False
+
+class LoopStats:
+	def __init__(self, stages, window=1200):
+		'''
+		:param stages: List of stage names (more stages are added when first timed)
+		:param window: Number of samples kept per stage
+		'''
+		self.window_size = window
+		self.windows = {}
+		self.timers = {}
+		self.started = time.time()
+		for name in stages:
+			self._add_stage(name)
+
+	def stage(self, name):
+		''' Get the timer (context manager) for a stage '''
+		timer = self.timers.get(name, None)
+		if timer is None:
+			timer = self._add_stage(name)
+		return timer
+
+	def record(self, name, seconds):
+		''' Add a duration measured elsewhere to a stage '''
+		self.stage(name).window.append(seconds)
+
+	def summary(self):
+		'''
+		Summarize the window of each stage
+
+		:return: Dictionary with the sample count, mean, max and percentiles (milliseconds) and histogram for each stage
+		'''
+		stages = {}
+		for name, window in self.windows.items():
+			samples = sorted(window)
+			count = len(samples)
+			stats = { 'count' : count }
+			if count:
+				stats['mean_ms'] = round(sum(samples) * 1000 / count, 3)
+				stats['max_ms'] = round(samples[-1] * 1000, 3)
+				for percentile in PERCENTILES:
+					stats[f'p{percentile}_ms'] = round(samples[min(count - 1, (count * percentile) // 100)] * 1000, 3)
+				histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+				for sample in samples:
+					histogram[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, sample * 1000)] += 1
+				stats['histogram'] = histogram
+			stages[name] = stats
+		return {
+			'time' : time.time(),
+			'started' : self.started,
+			'window' : self.window_size,
+			'histogram_bounds_ms' : HISTOGRAM_BOUNDS_MS,
+			'stages' : stages
+		}
+
+	def _add_stage(self, name):
+		window = deque(maxlen=self.window_size)
+		self.windows[name] = window
+		self.timers[name] = _StageTimer(window)
+		return self.timers[name]
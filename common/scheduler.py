@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+'''
+==============================================================================
+ PiFire Work Cycle Scheduler
+==============================================================================
+
+Description: Deadline scheduler for the control work cycle.  Periodic tasks
+	(i.e. display refresh, history) and one-shot deadlines (i.e. the next auger
+	toggle) are registered by name on the monotonic clock, so that periods don't
+	drift with loop jitter and are not affected by wall-clock changes (i.e. NTP
+	sync on boot).  The loop asks the scheduler how long it can sleep until the
+	next deadline, and checks which tasks are due when it wakes.
+
+	A task that is registered with a slack value reports a deadline miss when it
+	runs later than its deadline by more than the slack.
+
+==============================================================================
+'''
+
+'''
+==============================================================================
+ Imported Modules
+==============================================================================
+'''
+import time
+
+'''
+==============================================================================
+ Class Definition
+==============================================================================
+'''
+
+class Scheduler:
+	def __init__(self, clock=time.monotonic, on_miss=None, max_sleep=1.0):
+		'''
+		:param clock: Clock function (seconds)
+		:param on_miss: Function called with (name, lateness) when a task misses its deadline
+		:param max_sleep: Maximum time returned by sleep_time() in seconds
+		'''
+		self.clock = clock
+		self.on_miss = on_miss
+		self.max_sleep = max_sleep
+		self.tasks = {}
+
+	def now(self):
+		return self.clock()
+
+	def every(self, name, period, slack=None, now=None):
+		''' Register a periodic task, first due one period from now '''
+		now = self.clock() if now is None else now
+		self._task(name, slack)
+		self.tasks[name].update(period=period, deadline=now + period)
+
+	def at(self, name, deadline, slack=None):
+		''' Register (or move) a one-shot deadline, on the scheduler clock '''
+		self._task(name, slack)
+		self.tasks[name].update(period=None, deadline=deadline)
+
+	def cancel(self, name):
+		''' Stop a task from being due until it is registered again '''
+		if name in self.tasks:
+			self.tasks[name]['deadline'] = None
+
+	def reset(self, name, now=None):
+		''' Restart the period of a periodic task from now (i.e. after running it early) '''
+		task = self.tasks[name]
+		task['deadline'] = (self.clock() if now is None else now) + task['period']
+
+	def set_period(self, name, period):
+		''' Change the period of a periodic task, keeping the time it last ran '''
+		task = self.tasks[name]
+		if period != task['period']:
+			if task['deadline'] is not None:
+				task['deadline'] += period - task['period']
+			task['period'] = period
+
+	def due(self, name, now=None):
+		'''
+		Check if a task is due.  If it is, the task is counted as run: a periodic task moves to its next deadline,
+		and a one-shot deadline is cleared.
+
+		:return: True if the task is due
+		'''
+		task = self.tasks[name]
+		if task['deadline'] is None:
+			return False
+		now = self.clock() if now is None else now
+		lateness = now - task['deadline']
+		if lateness < 0:
+			return False
+
+		task['runs'] += 1
+		task['max_lateness'] = max(task['max_lateness'], lateness)
+		if task['slack'] is not None and lateness > task['slack']:
+			task['misses'] += 1
+			if self.on_miss is not None:
+				self.on_miss(name, lateness)
+
+		if task['period'] is None:
+			task['deadline'] = None
+		elif lateness >= task['period']:
+			# Skip the periods that were missed entirely, instead of running the task repeatedly to catch up
+			task['deadline'] = now + task['period']
+		else:
+			task['deadline'] += task['period']
+		return True
+
+	def sleep_time(self, now=None):
+		''' Time in seconds until the next deadline (0 if a task is already due), up to max_sleep '''
+		now = self.clock() if now is None else now
+		deadlines = [task['deadline'] for task in self.tasks.values() if task['deadline'] is not None]
+		if not deadlines:
+			return self.max_sleep
+		return min(max(min(deadlines) - now, 0.0), self.max_sleep)
+
+	def stats(self):
+		''' Run count, deadline misses and worst lateness (seconds) for each task '''
+		return { name : { 'period' : task['period'], 'runs' : task['runs'], 'misses' : task['misses'],
+			'max_lateness' : round(task['max_lateness'], 6) } for name, task in self.tasks.items() }
+
+	def _task(self, name, slack):
+		if name not in self.tasks:
+			self.tasks[name] = { 'period' : None, 'deadline' : None, 'slack' : slack, 'runs' : 0, 'misses' : 0, 'max_lateness' : 0.0 }
+		elif slack is not None:
+			self.tasks[name]['slack'] = slack
@@ -23,12 +23,21 @@ import logging
 import importlib
 from common import *  # Common Module for WebUI and Control Program
 from common.process_mon import Process_Monitor
+from common.scheduler import Scheduler
+from common.loopstats import LoopStats
 from notify.notifications import *
 from file_mgmt.recipes import convert_recipe_units
 from file_mgmt.cookfile import create_cookfile
 from file_mgmt.common import read_json_file_data
 from os.path import exists
 
+# Work cycle period in seconds (probes are read and outputs updated at this rate)
+CYCLE_PERIOD = 0.05
+
+# Work cycle stage timing, published to Redis every LOOP_STATS_PERIOD seconds (kept across modes)
+LOOP_STATS_PERIOD = 5
+loop_stats = LoopStats(['cycle', 'commands', 'probes', 'controller', 'notify', 'display', 'redis'])
+
 
 '''
 ==============================================================================
@@ -112,7 +121,8 @@ Set up Probes Input Module
 '''
 try: 
 	from probes.main import ProbesMain  # Probe device libary: loads probe devices and maps them to ports
-	probe_complex = ProbesMain(settings["probe_settings"]["probe_map"], settings['globals']['units'])
+	probe_complex = ProbesMain(settings["probe_settings"]["probe_map"], settings['globals']['units'], 
+		acquisition=settings['probe_settings'].get('acquisition', {}))
 
 except:
 	controlLogger.exception(f'Error occurred loading probes modules. Trace dump: ')
@@ -389,6 +399,7 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 	# Get initial probe sensor data, temperatures 
 	sensor_data = probe_complex.read_probes()
 	ptemp = list(sensor_data['primary'].values())[0]  # Primary Temperature or the Pit Temperature
+	prate = sensor_data['rate'].get(list(sensor_data['primary'].keys())[0], None)  # Filtered Rate of Change (if the probe has a filter)
 
 	# Safety Controls
 	if mode in ('Startup', 'Reignite'):
@@ -446,26 +457,26 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 		metrics['auger_cycle_time'] = settings['smartstart']['profiles'][profile_selected]['augerontime']
 		write_metrics(metrics)
 
-	# Set the start time
+	# Set the start time (wall clock, for display)
 	start_time = time.time()
 
-	# Set time since toggle for temperature
-	temp_toggle_time = start_time
+	# Periodic tasks and deadlines are scheduled on the monotonic clock, so loop jitter and wall-clock changes don't 
+	#  affect their timing.  Tasks with a slack value log a debug event when they run later than that.  
+	scheduler = Scheduler(on_miss=lambda name, lateness: eventLogger.debug(f'Scheduler: {name} ran {lateness:.3f}s late'))
+	cycle_start = scheduler.now()
+	scheduler.every('sample', CYCLE_PERIOD, slack=CYCLE_PERIOD, now=cycle_start)  # Probe reading / loop rate
+	scheduler.every('control_sync', 1, now=cycle_start)
+	scheduler.every('display', 0.5, slack=0.25, now=cycle_start)
+	scheduler.every('history', 3, slack=0.5, now=cycle_start)
+	scheduler.every('hopper', 300, now=cycle_start)
+	scheduler.every('fan_update', settings['pwm']['update_time'], now=cycle_start)
+	scheduler.every('loopstats', LOOP_STATS_PERIOD, now=cycle_start)
 
 	# Set time since toggle for auger
-	auger_toggle_time = start_time
-
-	# Set time since toggle for display
-	display_toggle_time = start_time
+	auger_toggle_time = cycle_start
 
 	# Initializing Start Time for Smoke Plus Mode
-	sp_cycle_toggle_time = start_time
-
-	# Set time since toggle for hopper check
-	hopper_toggle_time = start_time
-
-	# Set time since fan speed update
-	fan_update_time = start_time
+	sp_cycle_toggle_time = cycle_start
 
 	# Set Hold Mode Target Temp Boolean
 	target_temp_achieved = False
@@ -473,22 +484,60 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 	# Set Fan Ramping Boolean
 	pwm_fan_ramping = False
 
+	# Subscribe to control notifications, so that control is only read from Redis when a change is signaled
+	control_listener = subscribe_control_notify()
+	control_notified = True  # Force a read of control on the first pass
+
+	# Subscribe to settings changes, so that only the affected settings are reloaded 
+	settings_listener = subscribe_settings_changes()
+
 	# ============ Main Work Cycle ============
 	while status == 'Active':
-		now = time.time()
+		now = scheduler.now()
+		cycle_perf_start = time.perf_counter()
+		scheduler.due('sample', now)
 
-		execute_commands()
-		control = read_control()
+		# Execute commands when notified, or every second as a safety net in case a notification was missed
+		if scheduler.due('control_sync', now) or control_notified:
+			with loop_stats.stage('commands'):
+				execute_commands()
+				control = read_control()
+			scheduler.reset('control_sync', now)
+
+		# Queue up this iteration's Redis writes and send them in one round trip at the end of the loop
+		begin_write_batch()
 
 		# Check if new mode has been requested
 		if control['updated']:
 			break
 
-		# Check if user changed settings and reload
+		# Apply settings changes made by the app in memory, and reload only what they affect
+		settings_changes = read_settings_changes(settings_listener)
+		reload_cycle = False
+		if settings_changes is not None:
+			changed_paths = apply_settings_changes(settings, settings_changes)
+			reload_cycle = settings_changed(changed_paths, 'cycle_data')
+			if settings_changed(changed_paths, 'probe_settings', 'probe_map', 'probe_info'):
+				probe_complex.update_probe_profiles(settings['probe_settings']['probe_map']['probe_info'])
+			if settings_changed(changed_paths, 'probe_settings', 'acquisition'):
+				probe_complex.update_acquisition(settings['probe_settings']['acquisition'])
+			if settings_changed(changed_paths, 'pelletlevel'):
+				dist_device.update_distances(settings['pelletlevel']['empty'], settings['pelletlevel']['full'])
+			if dc_fan and settings_changed(changed_paths, 'pwm', 'frequency'):
+				grill_platform.set_pwm_frequency(settings['pwm']['frequency'])
+			# The pwm, smoke_plus and safety settings are read from settings on each use, so patching them is enough
+			eventLogger.debug(f'Settings changes applied: {sorted(".".join(map(str, path)) for path in changed_paths)}')
+
+		# Check if user changed settings and reload (fallback in case the change notification was missed).  The app 
+		#  publishes the changes before it sets the flag, so a notification for this update arrives in the same pass. 
 		if control['settings_update']:
 			control['settings_update'] = False
 			write_control(control, direct_write=True, origin='control')
-			settings = read_settings()
+			if settings_changes is None:
+				settings = read_settings()
+				reload_cycle = True
+
+		if reload_cycle:
 			if mode in ('Startup', 'Reignite', 'Smoke'):
 				OnTime = settings['cycle_data']['SmokeOnCycleTime']  # Auger On Time (Default 15s) 
 				OffTime = settings['cycle_data']['SmokeOffCycleTime'] + (settings['cycle_data']['PMode'] * 10)  # Auger Off Time
@@ -508,7 +557,7 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 			write_control(control, direct_write=True, origin='control')
 
 		# Check hopper level when requested or every 300 seconds
-		if control['hopper_check'] or (now - hopper_toggle_time) > 300:
+		if control['hopper_check'] or scheduler.due('hopper', now):
 			pelletdb = read_pellet_db()
 			override = False 
 			if control['hopper_check']:
@@ -518,7 +567,7 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 			# Get current hopper level and save it to the current pellet information
 			pelletdb['current']['hopper_level'] = dist_device.get_level(override=override)			
 			write_pellet_db(pelletdb)
-			hopper_toggle_time = now
+			scheduler.reset('hopper', now)
 			eventLogger.info("Hopper Level Checked @ " + str(pelletdb['current']['hopper_level']) + "%")
 
 		# Check for update in ON/OFF Switch
@@ -570,14 +619,23 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 
 		# Change Auger State based on Cycle Time
 		if mode in ('Startup', 'Reignite', 'Smoke', 'Hold', 'Prime'):
+			# Schedule the next auger toggle (ON after the Off Time, OFF after the On Time)
+			if current_output_status['auger']:
+				scheduler.at('auger', auger_toggle_time + (CycleTime * CycleRatio), slack=0.1)
+			else:
+				scheduler.at('auger', auger_toggle_time + (CycleTime * (1 - CycleRatio)), slack=0.1)
+			auger_due = scheduler.due('auger', now)
+
 			# If Auger is OFF and time since toggle is greater than Off Time
-			if not current_output_status['auger'] and (now - auger_toggle_time) > (CycleTime * (1 - CycleRatio)):
+			if not current_output_status['auger'] and auger_due:
 				grill_platform.auger_on()
 				auger_toggle_time = now
 				eventLogger.debug('Cycle Event: Auger On')
 				# Reset Cycle Time for HOLD Mode
 				if mode == 'Hold':
-					CycleRatio = RawCycleRatio = settings['cycle_data']['u_min'] if LidOpenDetect else controllerCore.update(ptemp)
+					with loop_stats.stage('controller'):
+						controllerCore.set_rate(prate)
+						CycleRatio = RawCycleRatio = settings['cycle_data']['u_min'] if LidOpenDetect else controllerCore.update(ptemp)
 					CycleRatio = max(CycleRatio, settings['cycle_data']['u_min'])
 					CycleRatio = min(CycleRatio, settings['cycle_data']['u_max'])
 					OnTime = settings['cycle_data']['HoldCycleTime'] * CycleRatio
@@ -587,11 +645,11 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 						OffTime) + ', CycleTime = ' + str(CycleTime) + ', CycleRatio = ' + str(CycleRatio))
 
 			# If Auger is ON and time since toggle is greater than On Time
-			if current_output_status['auger'] and (now - auger_toggle_time) > (CycleTime * CycleRatio):
+			elif current_output_status['auger'] and auger_due:
 				grill_platform.auger_off()
 				# Add auger ON time to the metrics
 				metrics['augerontime'] += now - auger_toggle_time
-				write_metrics(metrics)
+				increment_metrics('augerontime', now - auger_toggle_time)
 				# Set current last toggle time to now
 				auger_toggle_time = now
 				eventLogger.debug('Cycle Event: Auger Off')
@@ -605,8 +663,10 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 			probe_complex.update_probe_profiles(settings['probe_settings']['probe_map']['probe_info'])
 
 		# Get temperatures from all probes
-		sensor_data = probe_complex.read_probes()
+		with loop_stats.stage('probes'):
+			sensor_data = probe_complex.read_probes()
 		ptemp = list(sensor_data['primary'].values())[0]  # Primary Temperature or the Pit Temperature
+		prate = sensor_data['rate'].get(list(sensor_data['primary'].keys())[0], None)  # Filtered Rate of Change (if the probe has a filter)
 
 		in_data = {}
 		in_data['probe_history'] = sensor_data 
@@ -627,10 +687,11 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 			write_tr(in_data['probe_history']['tr'])
 
 		# Check to see if there are any pending notifications (i.e. Timer / Temperature Settings)
-		control = check_notify(in_data, control, settings, pelletdb, grill_platform)
+		with loop_stats.stage('notify'):
+			control = check_notify(in_data, control, settings, pelletdb, grill_platform)
 
 		# Send Current Status / Temperature Data to Display Device every 0.5 second (Display Refresh)
-		if (now - display_toggle_time) > 0.5:
+		if scheduler.due('display', now):
 			status_data = {} 
 			status_data['notify_data'] = control['notify_data']  # Get any flagged notifications
 			status_data['timer'] = control['timer']  # Get the timer information
@@ -647,6 +708,7 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 			status_data['lid_open_detected'] = LidOpenDetect if mode == 'Hold' else False
 			status_data['lid_open_endtime'] = LidOpenEventExpires if mode == 'Hold' else 0
 			status_data['p_mode'] = metrics.get('p_mode', None)
+			status_data['stale_probe_devices'] = probe_complex.get_stale_devices()  # Probe devices not returning data in time
 			if control['mode'] == 'Recipe':
 				status_data['recipe_paused'] = True if control['recipe']['step_data']['triggered'] and control['recipe']['step_data']['pause'] else False
 			else: 
@@ -659,10 +721,10 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 				except KeyError:
 					continue
 			# Send Data to Display
-			display_device.display_status(in_data, status_data)
+			with loop_stats.stage('display'):
+				display_device.display_status(in_data, status_data)
 			# Save Status Data to Redis 
 			write_status(status_data)
-			display_toggle_time = time.time()  # Reset the display_toggle_time to current time
 
 		# Safety Controls
 		if mode in ('Startup', 'Reignite'):
@@ -698,7 +760,7 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 				grill_platform.auger_off()
 				_start_fan(settings)
 				auger_toggle_time = now 
-				LidOpenEventExpires = now + settings['cycle_data']['LidOpenPauseTime']
+				LidOpenEventExpires = time.time() + settings['cycle_data']['LidOpenPauseTime']  # Wall clock (displayed)
 				target_temp_achieved = False
 
 			# Clear Lid Open Detect Event, Reset 
@@ -707,9 +769,9 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 					LidOpenDetect = False
 
 			# If PWM Fan Control enabled set duty_cycle based on temperature
+			scheduler.set_period('fan_update', settings['pwm']['update_time'])
 			if (dc_fan and mode == 'Hold' and control['pwm_control'] and
-					(now - fan_update_time) > settings['pwm']['update_time']):
-				fan_update_time = now
+					scheduler.due('fan_update', now)):
 				if ptemp > control['primary_setpoint']:
 					control['duty_cycle'] = settings['pwm']['min_duty_cycle']
 					write_control(control, direct_write=True, origin='control')
@@ -729,62 +791,70 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 							write_control(control, direct_write=True, origin='control')
 
 			# If in Smoke Plus Mode, Cycle the Fan
-			if (mode == 'Smoke' or (mode == 'Hold' and target_temp_achieved)) and control['s_plus']:
+			smoke_plus_active = (mode == 'Smoke' or (mode == 'Hold' and target_temp_achieved)) and control['s_plus']
+			if smoke_plus_active:
 				# If Temperature is > settings['smoke_plus']['max_temp']
 				# or Temperature is < settings['smoke_plus']['min_temp'] then turn on fan
 				if (ptemp > settings['smoke_plus']['max_temp'] or
 						ptemp < settings['smoke_plus']['min_temp']):
+					scheduler.cancel('smoke_plus')  # No fan toggles while the fan is held on
 					if not current_output_status['fan']:
 						_start_fan(settings, control['duty_cycle'])
 						eventLogger.debug('Smoke Plus: Over or Under Temp Fan ON')
-				elif (now - sp_cycle_toggle_time) > settings['smoke_plus']['on_time'] and current_output_status['fan']:
-					grill_platform.fan_off()
-					sp_cycle_toggle_time = now
-					eventLogger.debug('Smoke Plus: Fan OFF')
-				elif ((now - sp_cycle_toggle_time) > settings['smoke_plus']['off_time'] and
-					  not current_output_status['fan']):
-					sp_cycle_toggle_time = now
-					if (dc_fan and (mode == 'Smoke' or (mode == 'Hold' and not control['pwm_control'])) and
-							settings['smoke_plus']['fan_ramp']):
-						on_time = settings['smoke_plus']['on_time']
-						max_duty_cycle = settings['pwm']['max_duty_cycle']
-						min_duty_cycle = settings['pwm']['min_duty_cycle']
-						sp_duty_cycle = settings['smoke_plus']['duty_cycle']
-						grill_platform.pwm_fan_ramp(on_time, min_duty_cycle, max_duty_cycle * (sp_duty_cycle / 100))
-						pwm_fan_ramping = True
-						eventLogger.debug('Smoke Plus: Fan Ramping Up')
+				else:
+					# Schedule the next fan toggle (OFF after the On Time, ON after the Off Time)
+					if current_output_status['fan']:
+						scheduler.at('smoke_plus', sp_cycle_toggle_time + settings['smoke_plus']['on_time'])
 					else:
-						_start_fan(settings, control['duty_cycle'])
-						eventLogger.debug('Smoke Plus: Fan ON')
-
-			# If Smoke Plus was disabled when fan is OFF return fan to ON
-			elif not current_output_status['fan'] and not control['s_plus']:
-				_start_fan(settings, control['duty_cycle'])
-				eventLogger.debug('Smoke Plus: Fan Returned to On')
-
-			# If Smoke Plus was disabled while fan was ramping return it to the correct duty cycle
-			elif (dc_fan and current_output_status['pwm'] != control['duty_cycle'] and not
-					control['s_plus'] and pwm_fan_ramping):
-				pwm_fan_ramping = False
-				grill_platform.set_duty_cycle(control['duty_cycle'])
-				eventLogger.debug('Smoke Plus: Fan Returned to ' + str(control['duty_cycle']) + '% duty cycle')
-
-			# Set Fan Duty Cycle based on Average Grill Temp Using Profile
-			elif dc_fan and control['pwm_control'] and current_output_status['pwm'] != control['duty_cycle']:
-				grill_platform.set_duty_cycle(control['duty_cycle'])
-				eventLogger.debug('Temp Fan Control: Fan Set to ' + str(control['duty_cycle']) + '% duty cycle')
-
-			# If PWM Fan Control is turned off check current Duty Cycle and set back to max_duty_cycle if required
-			elif (dc_fan and not control['pwm_control'] and current_output_status['pwm'] !=
-				  	settings['pwm']['max_duty_cycle']):
-				control['duty_cycle'] = settings['pwm']['max_duty_cycle']
-				write_control(control, direct_write=True, origin='control')
-				grill_platform.set_duty_cycle(control['duty_cycle'])
-				eventLogger.debug('Temp Fan Control: Set to OFF, Fan Returned to Max Duty Cycle')
+						scheduler.at('smoke_plus', sp_cycle_toggle_time + settings['smoke_plus']['off_time'])
+
+					if scheduler.due('smoke_plus', now):
+						sp_cycle_toggle_time = now
+						if current_output_status['fan']:
+							grill_platform.fan_off()
+							eventLogger.debug('Smoke Plus: Fan OFF')
+						elif (dc_fan and (mode == 'Smoke' or (mode == 'Hold' and not control['pwm_control'])) and
+								settings['smoke_plus']['fan_ramp']):
+							on_time = settings['smoke_plus']['on_time']
+							max_duty_cycle = settings['pwm']['max_duty_cycle']
+							min_duty_cycle = settings['pwm']['min_duty_cycle']
+							sp_duty_cycle = settings['smoke_plus']['duty_cycle']
+							grill_platform.pwm_fan_ramp(on_time, min_duty_cycle, max_duty_cycle * (sp_duty_cycle / 100))
+							pwm_fan_ramping = True
+							eventLogger.debug('Smoke Plus: Fan Ramping Up')
+						else:
+							_start_fan(settings, control['duty_cycle'])
+							eventLogger.debug('Smoke Plus: Fan ON')
+			else:
+				scheduler.cancel('smoke_plus')  # Smoke Plus is off (or waiting for the target temperature)
+
+				# If Smoke Plus was disabled when fan is OFF return fan to ON
+				if not current_output_status['fan'] and not control['s_plus']:
+					_start_fan(settings, control['duty_cycle'])
+					eventLogger.debug('Smoke Plus: Fan Returned to On')
+
+				# If Smoke Plus was disabled while fan was ramping return it to the correct duty cycle
+				elif (dc_fan and current_output_status['pwm'] != control['duty_cycle'] and not
+						control['s_plus'] and pwm_fan_ramping):
+					pwm_fan_ramping = False
+					grill_platform.set_duty_cycle(control['duty_cycle'])
+					eventLogger.debug('Smoke Plus: Fan Returned to ' + str(control['duty_cycle']) + '% duty cycle')
+
+				# Set Fan Duty Cycle based on Average Grill Temp Using Profile
+				elif dc_fan and control['pwm_control'] and current_output_status['pwm'] != control['duty_cycle']:
+					grill_platform.set_duty_cycle(control['duty_cycle'])
+					eventLogger.debug('Temp Fan Control: Fan Set to ' + str(control['duty_cycle']) + '% duty cycle')
+
+				# If PWM Fan Control is turned off check current Duty Cycle and set back to max_duty_cycle if required
+				elif (dc_fan and not control['pwm_control'] and current_output_status['pwm'] !=
+					  	settings['pwm']['max_duty_cycle']):
+					control['duty_cycle'] = settings['pwm']['max_duty_cycle']
+					write_control(control, direct_write=True, origin='control')
+					grill_platform.set_duty_cycle(control['duty_cycle'])
+					eventLogger.debug('Temp Fan Control: Set to OFF, Fan Returned to Max Duty Cycle')
 
 		# Write History & Issue Heartbeat after 3 seconds has passed
-		if (now - temp_toggle_time) > 3:
-			temp_toggle_time = time.time()
+		if scheduler.due('history', now):
 			ext_data = True if settings['globals']['ext_data'] else False  # If passing in extended data, set to True
 			write_history(in_data, ext_data=ext_data)
 			monitor.heartbeat()  # Issue a heartbeat for the process monitor
@@ -796,15 +866,15 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 				startup_timer = settings['smartstart']['profiles'][profile_selected]['startuptime']
 			else: 
 				startup_timer = settings['globals']['startup_timer']
-			if (now - start_time) > startup_timer:
+			if (now - cycle_start) > startup_timer:
 				break
 
 		# Check if shutdown time has elapsed since shutdown mode started
-		if mode == 'Shutdown' and (now - start_time) > settings['globals']['shutdown_timer']:
+		if mode == 'Shutdown' and (now - cycle_start) > settings['globals']['shutdown_timer']:
 			break
 
 		# Check if prime time has elapsed
-		if mode == 'Prime' and (now - start_time) > prime_duration:
+		if mode == 'Prime' and (now - cycle_start) > prime_duration:
 			break
 
 		# Max Temp Safety Control
@@ -834,12 +904,26 @@ def _work_cycle(mode, grill_platform, probe_complex, display_device, dist_device
 					write_control(control, direct_write=True, origin='control')
 				# Continue until 'pause' variable is cleared 
 
-		time.sleep(0.05)
+		# Publish the loop statistics (with the scheduler deadline misses)
+		if scheduler.due('loopstats', now):
+			write_loop_stats(dict(loop_stats.summary(), mode=mode, scheduler=scheduler.stats()))
+
+		with loop_stats.stage('redis'):
+			flush_write_batch()
+		loop_stats.record('cycle', time.perf_counter() - cycle_perf_start)
+
+		# Sleep until the next scheduled deadline, waking early if a command arrives
+		control_notified = wait_for_control_notify(control_listener, timeout=scheduler.sleep_time())
 
 	# *********
 	# END Mode Loop
 	# *********
 
+	flush_write_batch()  # Send any writes queued before exiting the loop
+	control_listener.close()
+	settings_listener.close()
+	eventLogger.debug(f'Scheduler statistics: {scheduler.stats()}')
+
 	# Clean-up and Exit
 	grill_platform.auger_off()
 	grill_platform.igniter_off()
@@ -994,6 +1078,9 @@ if settings['globals']['boot_to_monitor']:
 ''' Initialize the status data on first run. '''
 status = read_status(init=True)
 
+''' Subscribe to control notifications to wake the main loop when commands arrive '''
+main_listener = subscribe_control_notify()
+
 while True:
 
 	# Check the On/Off switch for changes
@@ -1205,7 +1292,7 @@ while True:
 			_work_cycle('Reignite', grill_platform, probe_complex, display_device, dist_device)
 			_next_mode(control['next_mode'], setpoint=setpoint)
 
-	time.sleep(0.1)
+	wait_for_control_notify(main_listener, timeout=0.1)
 # ===================
 # End of Main Loop
 # ===================
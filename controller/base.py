@@ -25,6 +25,7 @@ class ControllerBase:
 		self.config = config
 		self.units = units
 		self.cycle_data = cycle_data 
+		self.rate = None
 
 	def update(self, current):
 		'''
@@ -43,6 +44,13 @@ class ControllerBase:
 		self.set_point = set_point
 		self.last_update = time.time()
 	
+	def set_rate(self, rate):
+		'''
+		Input:
+	        rate :: Filtered rate of change of the temperature (degrees per second), or None if not available
+	    '''
+		self.rate = rate
+
 	def get_config(self):
 		return self.config
 
@@ -50,6 +58,7 @@ class ControllerBase:
 		function_list = [
 			'update', 
 	        'set_target', 
+	        'set_rate', 
 	        'get_config'
         ]
 		return function_list
\ No newline at end of file
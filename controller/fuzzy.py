@@ -77,7 +77,11 @@ class Controller(ControllerBase):
         # Pass inputs to the ControlSystem using Antecedent labels with Pythonic API
         self.fuzzy_controller.input['delta'] = self.set_point - current  # Delta = Set Point - Current Temperature
         self.fuzzy_controller.input['current'] = current  # Current temperature
-        self.fuzzy_controller.input['rate_of_change'] = (current - self.last_temp) / cycle_time  # Rate of Change
+        if self.rate is not None:
+            # Filtered rate of change from the probe
+            self.fuzzy_controller.input['rate_of_change'] = self.rate * (9/5) if self.units == 'C' else self.rate
+        else:
+            self.fuzzy_controller.input['rate_of_change'] = (current - self.last_temp) / cycle_time  # Rate of Change
 
         # Crunch the numbers
         self.fuzzy_controller.compute()
@@ -98,6 +102,7 @@ class Controller(ControllerBase):
         function_list = [
 			'update', 
 	        'set_target', 
+	        'set_rate', 
 	        'get_config',
             'create_controller'
         ]
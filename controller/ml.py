@@ -56,7 +56,10 @@ class Controller(ControllerBase):
 			self.last_temp == current
 			cycle_time = self.cycle_time
 
-		rate_of_change = (current - self.last_temp) / cycle_time  # Rate of Change
+		if self.rate is not None:
+			rate_of_change = self.rate * (9/5) if self.units == 'C' else self.rate  # Filtered rate of change from the probe
+		else:
+			rate_of_change = (current - self.last_temp) / cycle_time  # Rate of Change
 
 		cycle_ratio = self.model.predict([[current, self.set_point, rate_of_change]])
 
@@ -70,6 +73,7 @@ class Controller(ControllerBase):
 	def supported_functions(self):
 		function_list = [
 			'update', 
-	        'set_target'
+	        'set_target', 
+	        'set_rate'
         ]
 		return function_list
@@ -49,7 +49,7 @@ class Display:
 		display_color = curses.color_pair(1)
 		for index, group in enumerate(in_data['probe_history']):
 			for item in in_data['probe_history'][group]:
-				if group != 'tr':
+				if group not in ('tr', 'rate'):
 					display_text = f"{item}: {in_data['probe_history'][group][item]} {self.units}"
 					self.screen.addstr(line, 3, display_text)
 					if group == 'primary':
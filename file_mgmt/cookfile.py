@@ -17,7 +17,7 @@ import json
 import zipfile 
 import pathlib
 
-from common import read_settings, read_history, generate_uuid, read_metrics, write_metrics, process_metrics, semantic_ver_to_list, epoch_to_time, unpack_history, default_probe_config
+from common import read_settings, read_history, generate_uuid, read_metrics, write_metrics, process_metrics, semantic_ver_to_list, epoch_to_time, unpack_history, history_column_values, default_probe_config
 from file_mgmt.common import read_json_file_data, update_json_file_data
 
 HISTORY_FOLDER = './history/'  # Path to historical cook files
@@ -74,8 +74,9 @@ def create_cookfile():
 	nowstring = now.strftime('%Y-%m-%d--%H%M')
 	title = nowstring + '-CookFile'
 
-	chart_data = prepare_chartdata(settings['history_page']['probe_config'], num_items=0, reduce=False, data_points=0)
 	raw_data = read_history()
+	history = unpack_history(raw_data) if raw_data != [] else None
+	chart_data = prepare_chartdata(settings['history_page']['probe_config'], num_items=0, reduce=False, data_points=0, history=history)
 
 	if len(chart_data['time_labels']):
 		starttime = chart_data['time_labels'][0]
@@ -283,7 +284,7 @@ def upgrade_cookfile(cookfilename, repair=False):
 
 	return(cookfilestruct, status)
 
-def prepare_chartdata(probe_config, chart_info={}, num_items=10, reduce=True, data_points=60, history=None):
+def prepare_chartdata(probe_config, chart_info={}, num_items=10, reduce=True, data_points=60, history=None, start_ms=None, end_ms=None, reduce_mode='stride'):
 	''' Build Probe Mapper and Chart Data Struct '''
 	chart_data = []
 
@@ -368,19 +369,21 @@ def prepare_chartdata(probe_config, chart_info={}, num_items=10, reduce=True, da
 
 	''' Populate history data into chart data '''
 	if history == None:
-		history = read_history(num_items)
+		# Read from a downsampled tier when the chart is reduced, so the cost doesn't grow with the length of the cook
+		history = read_history(num_items, data_points=data_points if reduce else 0, start_ms=start_ms, end_ms=end_ms, columns=True)
 		if history !=[]: 
-			history = unpack_history(history)
 			list_length = len(history['T']) # Length of list(s)
 		else: 
 			list_length = 0
+		if start_ms is not None or end_ms is not None:
+			num_items = list_length  # Use every item in the requested time range
 	else: 
 		list_length = len(history['T']) # Length of list(s)
 
 	if (list_length < num_items) and (list_length > 0):
 		num_items = list_length
 
-	if reduce and (num_items > data_points):
+	if reduce and (num_items > data_points) and (reduce_mode == 'stride'):
 		step = int(num_items/data_points)
 	else:
 		step = 1
@@ -388,22 +391,28 @@ def prepare_chartdata(probe_config, chart_info={}, num_items=10, reduce=True, da
 	if num_items == 0: 
 		num_items = list_length
 
+	indices = range(list_length - num_items, list_length, step)
+	if reduce and (num_items > data_points) and (reduce_mode != 'stride') and (list_length > 0):
+		primary_key = list(history['P'].keys())[0]
+		selected = select_chart_indices(history['T'][list_length - num_items:], 
+			history['P'][primary_key][list_length - num_items:], data_points, reduce_mode)
+		indices = [index + list_length - num_items for index in selected]
+
 	time_labels = []
 
 	if (list_length > 0):
-		# Build all lists from file data
-		for index in range(list_length - num_items, list_length, step):
-			for key, value in history['P'].items():
-				chart_data[probe_mapper['probes'][key]]['data'].append(history['P'][key][index])
-			for key, value in history['F'].items():
-				chart_data[probe_mapper['probes'][key]]['data'].append(history['F'][key][index])
-			for key, value in history['NT'].items():
-				chart_data[probe_mapper['targets'][key]]['data'].append(history['NT'][key][index])
-			for key in probe_mapper['primarysp']: 
-				chart_data[probe_mapper['primarysp'][key]]['data'].append(history['PSP'][index])
-				break 
-
-			time_labels.append(history['T'][index])
+		# Build all lists from the history columns
+		for key, column in history['P'].items():
+			chart_data[probe_mapper['probes'][key]]['data'] = history_column_values(column, indices)
+		for key, column in history['F'].items():
+			chart_data[probe_mapper['probes'][key]]['data'] = history_column_values(column, indices)
+		for key, column in history['NT'].items():
+			chart_data[probe_mapper['targets'][key]]['data'] = history_column_values(column, indices)
+		for key in probe_mapper['primarysp']: 
+			chart_data[probe_mapper['primarysp'][key]]['data'] = history_column_values(history['PSP'], indices)
+			break 
+
+		time_labels = history_column_values(history['T'], indices)
 	else:
 		now = datetime.datetime.now()
 		time_now = int(now.timestamp() * 1000)  # Use timestamp format * 1000 for JavaScript usages
@@ -424,3 +433,111 @@ def prepare_chartdata(probe_config, chart_info={}, num_items=10, reduce=True, da
 	}
 
 	return data_blob
+
+def reduce_chartdata(graph_data, data_points, reduce_mode='lttb'):
+	''' Downsample prepared chart data (i.e. cookfile graph data) to approximately data_points points '''
+	time_labels = graph_data['time_labels']
+	if (reduce_mode == 'stride') or (len(time_labels) <= data_points):
+		return graph_data
+
+	# Select points on the primary probe (or the first probe if no primary probe is mapped)
+	probe_mapper = graph_data['probe_mapper']
+	primary_key = list(probe_mapper['primarysp'].keys())[0] if probe_mapper['primarysp'] else list(probe_mapper['probes'].keys())[0]
+	primary_data = graph_data['chart_data'][probe_mapper['probes'][primary_key]]['data']
+	indices = select_chart_indices(time_labels, primary_data, data_points, reduce_mode)
+
+	reduced_data = graph_data.copy()
+	reduced_data['time_labels'] = [time_labels[index] for index in indices]
+	reduced_data['chart_data'] = []
+	for chart_obj in graph_data['chart_data']:
+		chart_obj = chart_obj.copy()
+		chart_obj['data'] = [chart_obj['data'][index] for index in indices]
+		reduced_data['chart_data'].append(chart_obj)
+	return reduced_data
+
+def select_chart_indices(x_values, y_values, data_points, reduce_mode='lttb'):
+	''' 
+	Select the indices of the points to keep when downsampling a series.  
+	
+	reduce_mode:
+		'lttb' - Largest-Triangle-Three-Buckets, keeps the points that best preserve the visual shape of the series 
+		'minmax' - Keeps the minimum and maximum point of each bucket, so that short spikes / dips are never dropped 
+
+	Points without a value (None / NaN) are not candidates for selection, but the first point of each gap is kept, so 
+	that the gap still shows on the chart.  
+	'''
+	list_length = len(y_values)
+	if (list_length <= data_points) or (data_points < 3):
+		return list(range(list_length))
+
+	x_values = x_values.tolist() if hasattr(x_values, 'tolist') else x_values
+	valid = []
+	gaps = []
+	in_gap = False
+	for index, value in enumerate(y_values):
+		if isinstance(value, (int, float)) and value == value:
+			valid.append(index)
+			in_gap = False
+		elif not in_gap:
+			gaps.append(index)  # First point of a gap
+			in_gap = True
+
+	if len(valid) <= data_points:
+		selected = valid
+	elif reduce_mode == 'minmax':
+		selected = [valid[index] for index in _minmax_indices([y_values[index] for index in valid], data_points)]
+	else:
+		selected = [valid[index] for index in _lttb_indices([x_values[index] for index in valid], 
+			[y_values[index] for index in valid], data_points)]
+
+	return sorted(set(selected).union(gaps)) if gaps else selected
+
+def _lttb_indices(x_values, y_values, data_points):
+	list_length = len(y_values)
+	bucket_size = (list_length - 2) / (data_points - 2)
+	indices = [0]
+	selected = 0 
+
+	for bucket in range(data_points - 2):
+		# Average point of the next bucket 
+		next_start = int((bucket + 1) * bucket_size) + 1
+		next_end = min(int((bucket + 2) * bucket_size) + 1, list_length)
+		next_count = next_end - next_start
+		avg_x = sum(x_values[next_start:next_end]) / next_count
+		avg_y = sum(y_values[next_start:next_end]) / next_count
+
+		# Point in this bucket forming the largest triangle with the last selected point and the next bucket average
+		point_x = x_values[selected]
+		point_y = y_values[selected]
+		dx = point_x - avg_x
+		dy = avg_y - point_y
+		max_area = -1
+		for index in range(int(bucket * bucket_size) + 1, next_start):
+			area = abs(dx * (y_values[index] - point_y) + (x_values[index] - point_x) * dy)
+			if area > max_area:
+				max_area = area
+				next_selected = index
+		indices.append(next_selected)
+		selected = next_selected
+
+	indices.append(list_length - 1)
+	return indices
+
+def _minmax_indices(y_values, data_points):
+	list_length = len(y_values)
+	num_buckets = max((data_points - 2) // 2, 1)
+	bucket_size = list_length / num_buckets
+	indices = [0]
+
+	for bucket in range(num_buckets):
+		start = int(bucket * bucket_size)
+		end = min(int((bucket + 1) * bucket_size), list_length)
+		segment = y_values[start:end]
+		if not segment:
+			continue
+		low = start + segment.index(min(segment))
+		high = start + segment.index(max(segment))
+		indices.extend(sorted({low, high}))
+
+	indices.append(list_length - 1)
+	return sorted(set(indices))
@@ -22,7 +22,7 @@ import requests
 import json
 import apprise
 import logging
-from common import write_settings, write_control, create_logger
+from common import write_settings, write_control, get_event_logger
 
 '''
 ==============================================================================
@@ -46,7 +46,7 @@ def check_notify(in_data, control, settings, pelletdb, grill_platform):
 	''' Get simple list of temperatures key:value pairs '''
 	probe_temp_list = {}
 	for group in in_data['probe_history']:
-		if group != 'tr':
+		if group not in ('tr', 'rate'):
 			for probe in in_data['probe_history'][group]:
 				probe_temp_list[probe] = in_data['probe_history'][group][probe]
 
@@ -104,8 +104,7 @@ def send_notifications(notify_event, control, settings, pelletdb, label='Probe',
 	:param settings: Settings
 	:param pelletdb: Pellet DB
 	"""
-	log_level = logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO
-	eventLogger = create_logger('events', filename='/tmp/events.log', messageformat='%(asctime)s [%(levelname)s] %(message)s', level=log_level)
+	eventLogger = get_event_logger(logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO)
 	date = datetime.datetime.now()
 	now = date.strftime('%m-%d %H:%M')
 	time = date.strftime('%H:%M')
@@ -198,8 +197,7 @@ def _send_apprise_notifications(settings, title_message, body_message):
 	:param title_message: Message Title
 	:param body_message: Message Body
 	"""
-	log_level = logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO
-	eventLogger = create_logger('events', filename='/tmp/events.log', messageformat='%(asctime)s [%(levelname)s] %(message)s', level=log_level)
+	eventLogger = get_event_logger(logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO)
 	if(len(settings['notify_services']['apprise']['locations'])):
 		eventLogger.info("Sending Apprise Notifications: " + ", ".join(settings['notify_services']['apprise']['locations']))
 		appriseHandler = apprise.Apprise()
@@ -222,8 +220,7 @@ def _send_pushover_notification(settings, title_message, body_message):
 	:param title_message: Message Title
 	:param body_message: Message Body
 	"""
-	log_level = logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO
-	eventLogger = create_logger('events', filename='/tmp/events.log', messageformat='%(asctime)s [%(levelname)s] %(message)s', level=log_level)
+	eventLogger = get_event_logger(logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO)
 	url = 'https://api.pushover.net/1/messages.json'
 	for user in settings['notify_services']['pushover']['UserKeys'].split(','):
 		try:
@@ -255,8 +252,7 @@ def _send_pushbullet_notification(settings, title_message, body_message):
 	:param body_message: Message Body
 	:return:
 	"""
-	log_level = logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO
-	eventLogger = create_logger('events', filename='/tmp/events.log', messageformat='%(asctime)s [%(levelname)s] %(message)s', level=log_level)
+	eventLogger = get_event_logger(logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO)
 	api_key = settings['notify_services']['pushbullet']['APIKey']
 	pushbullet_link = settings['notify_services']['pushbullet']['PublicURL']
 	url = "https://api.pushbullet.com/v2/pushes"
@@ -287,8 +283,7 @@ def _send_onesignal_notification(settings, title_message, body_message, channel)
 	:param body_message: Message Body
 	:param channel: Android Notifications Channel
 	"""
-	log_level = logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO
-	eventLogger = create_logger('events', filename='/tmp/events.log', messageformat='%(asctime)s [%(levelname)s] %(message)s', level=log_level)
+	eventLogger = get_event_logger(logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO)
 	app_id = settings['notify_services']['onesignal']['app_id']
 	devices = settings['notify_services']['onesignal']['devices']
 	url = "https://onesignal.com/api/v1/notifications"
@@ -341,8 +336,7 @@ def _send_ifttt_notification(settings, notify_event, query_args):
 	:param notify_event: String Event
 	:param query_args: Query Args
 	"""
-	log_level = logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO
-	eventLogger = create_logger('events', filename='/tmp/events.log', messageformat='%(asctime)s [%(levelname)s] %(message)s', level=log_level)
+	eventLogger = get_event_logger(logging.DEBUG if settings['globals']['debug_mode'] else logging.INFO)
 	key = settings['notify_services']['ifttt']['APIKey']
 	url = 'https://maker.ifttt.com/trigger/' + notify_event + '/with/key/' + key
 
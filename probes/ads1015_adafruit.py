@@ -20,6 +20,8 @@ Description:
             	'ADC2_rd': '10000',
             	'ADC3_rd': '10000',
             	'i2c_bus_addr': '0x48',
+				'conversion_mode': 'single',	# 'single' (single-shot) or 'continuous' conversion
+				'data_rate': '',				# Samples per second (blank for the library default)
             	'voltage_ref': '3.28'
 			}
 		} 
@@ -35,6 +37,7 @@ import math
 import board
 import busio
 import adafruit_ads1x15.ads1015 as ADS
+from adafruit_ads1x15.ads1x15 import Mode
 from adafruit_ads1x15.analog_in import AnalogIn
 from probes.base import ProbeInterface
 
@@ -53,12 +56,18 @@ BUSMAP = {
 
 class ADSDevice():
 	''' ADS1015 Device Based on the Adafruit Module '''
-	def __init__(self, i2c_bus_addr=0x48):
+	def __init__(self, i2c_bus_addr=0x48, continuous=False, data_rate=None):
 		self.logger = logging.getLogger("control")
 		# Create the I2C bus
 		self.i2c = busio.I2C(board.SCL, board.SDA)
 		# Create the ADC object using the I2C bus
 		self.ads = ADS.ADS1015(self.i2c, address=i2c_bus_addr)
+		if data_rate:
+			self.ads.data_rate = data_rate
+		if continuous:
+			# Convert continuously: repeated reads of the same port return the last result without waiting, and 
+			#  the library waits for the conversion only when switching ports 
+			self.ads.mode = Mode.CONTINUOUS
 
 	def read_voltage(self, port):
 		adc_ports = {
@@ -76,12 +85,15 @@ class ADSDevice():
 		return voltage
 
 class ReadProbes(ProbeInterface):
+	bus_type = 'i2c'
 
 	def __init__(self, probe_info, device_info, units):
 		super().__init__(probe_info, device_info, units)
 
 	def _init_device(self):
-		self.time_delay = 0.008
+		continuous = self.device_info['config'].get('conversion_mode', 'single') == 'continuous'
+		data_rate = int(self.device_info['config'].get('data_rate', '') or 0)
+		self.time_delay = 0 if continuous else 0.008  # No fixed delay needed in continuous conversion mode
 		self.device_info['ports'] = ['ADC0', 'ADC1', 'ADC2', 'ADC3']
 		i2c_bus_addr = BUSMAP[self.device_info['config'].get('i2c_bus_addr', '0x48')]
-		self.device = ADSDevice(i2c_bus_addr=i2c_bus_addr)
\ No newline at end of file
+		self.device = ADSDevice(i2c_bus_addr=i2c_bus_addr, continuous=continuous, data_rate=data_rate)
\ No newline at end of file
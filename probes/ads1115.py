@@ -69,6 +69,7 @@ class ADSDevice():
 		return voltage
 
 class ReadProbes(ProbeInterface):
+	bus_type = 'i2c'
 
 	def __init__(self, probe_info, device_info, units):
 		super().__init__(probe_info, device_info, units)
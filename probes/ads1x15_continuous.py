@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+'''
+*****************************************
+PiFire Probes ADS1115/ADS1015 Continuous Conversion Module
+*****************************************
+
+Description:
+  This module runs the ADS1115 (or ADS1015) in continuous conversion mode at a configured data rate and returns
+  temperature data.  Instead of starting a single-shot conversion and sleeping for each port, the ADC converts
+  continuously while the driver rotates the input multiplexer across the ports.  A port's result is read once
+  the conversions after the multiplexer switch have completed (two conversion periods), and reads never sleep:
+  each read advances the rotation if the current conversion is complete and returns the latest value for the
+  requested port.  The primary port is interleaved between the other ports, so that the reading used by the
+  controller is refreshed most often.
+
+  For the best throughput, use this module with threaded probe acquisition (probe_settings -> acquisition) and
+  a sample period close to two conversion periods.
+
+  Setting 'i2c_bus' to 'fake' uses a simulated ADC (FakeI2CBus), so that this module can be tested off-Pi.
+
+	Ex Device Definition:
+
+	device = {
+			'device' : 'your_device_name',	# Unique name for the device
+			'module' : 'ads1x15_continuous',	# Must be populated for this module to load properly
+			'ports' : ['ADC0', 'ADC1', 'ADC2', 'ADC3'], # This is defined in the module, so this does not need to be defined.
+			'config' : {
+				'ADC0_rd': '10000',
+            	'ADC1_rd': '10000',
+            	'ADC2_rd': '10000',
+            	'ADC3_rd': '10000',
+            	'i2c_bus_addr': '0x48',
+				'i2c_bus': '1',			# I2C bus number, or 'fake' for the simulated ADC
+				'chip': 'ads1115',		# 'ads1115' or 'ads1015'
+				'data_rate': '475',		# Samples per second (must be supported by the chip)
+            	'voltage_ref': '3.28'
+			}
+		}
+'''
+
+'''
+*****************************************
+ Imported Libraries
+*****************************************
+'''
+import logging
+import math
+import time
+from probes.base import ProbeInterface
+
+try:
+	from smbus2 import SMBus
+except ImportError:
+	SMBus = None  # Only the simulated ADC (i2c_bus = 'fake') is available
+
+'''
+*****************************************
+ Class Definitions
+*****************************************
+'''
+
+BUSMAP = {
+	'0x48' : 0x48,  # Address Pin GND
+	'0x49' : 0x49,  # Address Pin VIN
+	'0x4A' : 0x4A,	# Address Pin SDA
+	'0x4B' : 0x4B	# Address Pin SCL
+}
+
+ADC_PORTS = {
+	'ADC0' : 0,
+	'ADC1' : 1,
+	'ADC2' : 2,
+	'ADC3' : 3
+}
+
+''' Registers '''
+REG_CONVERSION = 0x00
+REG_CONFIG = 0x01
+
+''' Config register fields '''
+CONFIG_MUX_SINGLE = 0x4000  # AINx vs GND, with the channel in bits 12-13
+CONFIG_PGA_4_096V = 0x0200  # +/-4.096V full scale
+CONFIG_MODE_CONTINUOUS = 0x0000
+CONFIG_COMP_QUE_DISABLE = 0x0003
+FULL_SCALE = 4.096
+
+''' Data rate (samples per second) to config register DR field, and result resolution, for each chip '''
+CHIPS = {
+	'ads1115' : {
+		'rates' : { 8 : 0, 16 : 1, 32 : 2, 64 : 3, 128 : 4, 250 : 5, 475 : 6, 860 : 7 },
+		'default_rate' : 475,
+		'shift' : 0, 		# 16-bit result
+		'max_code' : 32768
+	},
+	'ads1015' : {
+		'rates' : { 128 : 0, 250 : 1, 490 : 2, 920 : 3, 1600 : 4, 2400 : 5, 3300 : 6 },
+		'default_rate' : 1600,
+		'shift' : 4, 		# 12-bit result, left justified
+		'max_code' : 2048
+	}
+}
+
+class FakeI2CBus:
+	''' Simulated ADS1x15 on an I2C bus (smbus2 style interface), for testing without hardware '''
+	def __init__(self, chip='ads1115', voltages=None):
+		self.chip = CHIPS[chip]
+		self.registers = { REG_CONVERSION : 0, REG_CONFIG : 0x8583 }  # Power-on default config (single-shot)
+		self.voltages = voltages if voltages is not None else [0.316, 3.0, 3.0, 3.0]
+		self.mux_time = time.monotonic()
+		self.config_writes = 0
+
+	def set_voltage(self, channel, voltage):
+		self.voltages[channel] = voltage
+
+	def write_i2c_block_data(self, address, register, data):
+		self.registers[register] = (data[0] << 8) | data[1]
+		if register == REG_CONFIG:
+			self.mux_time = time.monotonic()
+			self.config_writes += 1
+
+	def read_i2c_block_data(self, address, register, length):
+		if register == REG_CONVERSION:
+			self._convert()
+		value = self.registers[register]
+		return [(value >> 8) & 0xFF, value & 0xFF]
+
+	def _convert(self):
+		''' Update the conversion register, if a conversion with the current multiplexer setting has completed '''
+		config = self.registers[REG_CONFIG]
+		rate = [rate for rate, dr in self.chip['rates'].items() if dr == (config >> 5) & 0x07]
+		period = 1 / rate[0] if rate else 1 / self.chip['default_rate']
+		if time.monotonic() - self.mux_time < period:
+			return
+		channel = (config >> 12) & 0x03
+		code = int(self.voltages[channel] / FULL_SCALE * self.chip['max_code'])
+		code = max(min(code, self.chip['max_code'] - 1), -self.chip['max_code'])
+		self.registers[REG_CONVERSION] = (code << self.chip['shift']) & 0xFFFF
+
+class ADSContinuousDevice():
+	''' ADS1115 / ADS1015 in continuous conversion mode, rotating the multiplexer across the ports '''
+	def __init__(self, ports, primary_port=None, i2c_bus_addr=0x48, i2c_bus=1, chip='ads1115', data_rate=None):
+		self.logger = logging.getLogger("control")
+		self.address = i2c_bus_addr
+		self.chip = CHIPS[chip]
+		self.data_rate = data_rate if data_rate in self.chip['rates'] else self.chip['default_rate']
+		# Switching the multiplexer while converting: the conversion in progress completes with the old input,
+		#  so wait for two conversion periods (plus a margin for the internal oscillator tolerance)
+		self.settle_time = (2 / self.data_rate) * 1.1
+
+		if i2c_bus == 'fake':
+			self.bus = FakeI2CBus(chip=chip)
+		else:
+			self.bus = SMBus(int(i2c_bus))
+
+		''' Rotation order, with the primary port between each of the other ports '''
+		self.rotation = []
+		for port in ports:
+			if port != primary_port:
+				if primary_port in ports:
+					self.rotation.append(primary_port)
+				self.rotation.append(port)
+		if not self.rotation:
+			self.rotation = list(ports) if ports else ['ADC0']
+
+		self.latest = {}  # Latest voltage (mV) for each port
+		self.position = 0
+		self._select(self.rotation[0])
+
+	def read_voltage(self, port):
+		try:
+			self._advance()
+			if port not in self.latest:
+				''' No reading for this port yet (i.e. first read), so wait for the rotation to reach it '''
+				for step in range(len(self.rotation) + 1):
+					time.sleep(max(self.ready_time - time.monotonic(), 0))
+					self._advance()
+					if port in self.latest:
+						break
+			voltage = self.latest.get(port, 0)
+		except:
+			self.logger.exception(f'Exception occurred while reading probe port {port}.  Trace dump: ')
+			voltage = 0
+		return voltage
+
+	def _advance(self):
+		''' If the current port's conversion is complete, store it and switch to the next port in the rotation '''
+		now = time.monotonic()
+		if now < self.ready_time:
+			return
+		port = self.rotation[self.position]
+		data = self.bus.read_i2c_block_data(self.address, REG_CONVERSION, 2)
+		code = (data[0] << 8) | data[1]
+		if code & 0x8000:
+			code -= 0x10000  # Two's complement
+		code >>= self.chip['shift']
+		self.latest[port] = math.floor(code * FULL_SCALE / self.chip['max_code'] * 1000)
+		self.position = (self.position + 1) % len(self.rotation)
+		self._select(self.rotation[self.position])
+
+	def _select(self, port):
+		''' Point the multiplexer at a port (continuous conversion mode) '''
+		config = CONFIG_MUX_SINGLE | (ADC_PORTS[port] << 12) | CONFIG_PGA_4_096V | CONFIG_MODE_CONTINUOUS \
+			| (self.chip['rates'][self.data_rate] << 5) | CONFIG_COMP_QUE_DISABLE
+		self.bus.write_i2c_block_data(self.address, REG_CONFIG, [(config >> 8) & 0xFF, config & 0xFF])
+		self.ready_time = time.monotonic() + self.settle_time
+
+class ReadProbes(ProbeInterface):
+	bus_type = 'i2c'
+
+	def __init__(self, probe_info, device_info, units):
+		super().__init__(probe_info, device_info, units)
+
+	def _init_device(self):
+		self.time_delay = 0  # No fixed delay needed in continuous conversion mode
+		self.device_info['ports'] = ['ADC0', 'ADC1', 'ADC2', 'ADC3']
+		config = self.device_info['config']
+		i2c_bus_addr = BUSMAP[config.get('i2c_bus_addr', '0x48')]
+		chip = config.get('chip', 'ads1115')
+		data_rate = int(config.get('data_rate', CHIPS[chip]['default_rate']))
+		self.device = ADSContinuousDevice(list(self.port_map.keys()), primary_port=self.primary_port,
+			i2c_bus_addr=i2c_bus_addr, i2c_bus=config.get('i2c_bus', 1), chip=chip, data_rate=data_rate)
@@ -19,7 +19,74 @@ Description:
 import math
 import time
 import logging
+import threading
+from array import array
 from probes.temp_queue import TempQueue
+from probes.temp_filter import TempFilter
+
+DEFAULT_BUS_NUMBER = { 'i2c' : '1', 'spi' : '0' }
+DEFAULT_QUEUE_LENGTH = 10  # Number of readings averaged for each port, unless set by 'queue_length' in the probe info
+
+'''
+*****************************************
+ Functions 
+*****************************************
+'''
+
+def steinhart_hart(voltage, probe_profile):
+	'''
+	Exact conversion of the voltage at the divider to temperature for a thermistor probe profile
+
+	:param voltage: Voltage at the divider in mV (greater than 0)
+	:param probe_profile: Probe profile (A, B, C, Rd and Vs)
+	:return: (temperature in Kelvin, thermistor resistance Tr in Ohms)
+	'''
+	Vo = (voltage / 1000) # mV to V of ADC (at the divider)
+
+	'''
+	Thermistor Resistor Value Ohms (R1)
+	 R1 = ( (Vin * R2) - (Vout * R2) ) / Vout
+	 Tr = ((probe_profile['Vs'] * probe_profile['Rd']) - (Vo * probe_profile['Rd'])) / Vo
+	 R2 = ( Vout * R1 ) / ( Vin - Vout )
+	'''
+	if Vo < probe_profile['Vs']:
+		Tr = ( Vo * probe_profile['Rd']) / ( probe_profile['Vs'] - Vo )
+	else:
+		Tr = ( Vo * probe_profile['Rd']) / ( 0.001 )
+
+	''' Coefficient a, b, & c values '''
+	a = probe_profile['A']
+	b = probe_profile['B']
+	c = probe_profile['C']
+
+	'''
+	Steinhart Hart Equation
+	 1/T = A + B(ln(R)) + C(ln(R))^3
+	 T = 1/(a + b[ln(ohm)] + c[ln(ohm)]^3)
+	'''
+	lnohm = math.log(Tr) # ln(ohms)
+
+	t1 = (b*lnohm) # b[ln(ohm)]
+
+	t2 = c * math.pow(lnohm,3) # c[ln(ohm)]^3
+
+	tempK = 1/(a + t1 + t2) # calculate temperature in Kelvin
+
+	return tempK, Tr
+
+def probe_output(tempK, Tr, units):
+	''' Convert a temperature in Kelvin and Tr to the probe output (temperature in units, Tr rounded to Ohms) '''
+	tempC = tempK - 273.15 # Kelvin to Celsius
+
+	if units == 'F':
+		tempF = tempC * (9/5) + 32 # Celsius to Farenheit
+
+		''' Check bounds for realistic temperature values (0-600F), else report 0F '''
+		if (tempF < 0) or (tempF > 600):
+			tempF = 0
+		return tempF, round(Tr)
+	else:
+		return tempC, round(Tr)
 
 '''
 *****************************************
@@ -27,15 +94,114 @@ from probes.temp_queue import TempQueue
 *****************************************
 '''
 
+class ProfileTable:
+	'''
+	Voltage to temperature table for a probe profile.  The exact Steinhart-Hart conversion is calculated once for 
+	every step (default 1mV) between 0V and Vs, and readings are converted by linear interpolation between the two 
+	nearest steps (exact for readings on a step, i.e. whole mV readings).  The final output for the readings on a 
+	step is also kept for each units, so that whole mV readings are converted with a single index.  
+	'''
+	def __init__(self, probe_profile, step=1.0):
+		self.probe_profile = probe_profile
+		self.step = step
+		self.start = step  # 0mV is outside the formula's range
+		self.end = probe_profile['Vs'] * 1000 - step  # Tr changes formula at Vs, so stop one step short of it
+		count = max(int((self.end - self.start) / step) + 1, 0)
+		self.temp_k = array('d')
+		self.tr = array('d')
+		for index in range(count):
+			try:
+				tempK, Tr = steinhart_hart(self.start + index * step, probe_profile)
+			except (ValueError, ZeroDivisionError, OverflowError):
+				tempK, Tr = math.nan, math.nan  # Readings around this step use the exact formula
+			self.temp_k.append(tempK)
+			self.tr.append(Tr)
+		self.last = count - 1
+		self.outputs = {}  # Output (temperature, Tr) for each step, by units (built when first used)
+
+	def convert(self, voltage, units):
+		'''
+		:param voltage: Voltage at the divider in mV
+		:param units: Temperature units
+		:return: (temperature in units, Tr in Ohms), or None if the voltage is outside the table
+		'''
+		position = (voltage - self.start) / self.step
+		index = int(position)
+		if index == position and 0 <= index <= self.last:
+			outputs = self.outputs.get(units, None)
+			if outputs is None:
+				outputs = [None if tempK != tempK else probe_output(tempK, Tr, units) for tempK, Tr in zip(self.temp_k, self.tr)]
+				self.outputs[units] = outputs
+			return outputs[index]
+		result = self.lookup(voltage)
+		return probe_output(result[0], result[1], units) if result is not None else None
+
+	def lookup(self, voltage):
+		'''
+		:param voltage: Voltage at the divider in mV
+		:return: (temperature in Kelvin, Tr in Ohms), or None if the voltage is outside the table
+		'''
+		position = (voltage - self.start) / self.step
+		index = int(position)
+		if position < 0 or index >= self.last:
+			if index == self.last and position == index:
+				return self.temp_k[index], self.tr[index]
+			return None
+		fraction = position - index
+		k0 = self.temp_k[index]
+		tr0 = self.tr[index]
+		tempK = k0 + (self.temp_k[index + 1] - k0) * fraction
+		if tempK != tempK:
+			return None  # NaN
+		return tempK, tr0 + (self.tr[index + 1] - tr0) * fraction
+
+	def accuracy(self, units='F', step=0.05):
+		'''
+		Compare the table against the exact formula, for readings between table steps across the usable range
+
+		:param units: Temperature units of the report
+		:param step: Voltage step of the comparison in mV
+		:return: Dictionary with the maximum and mean absolute temperature error, the voltage at the maximum 
+			error, and the number of points compared (readings within 0-600F)
+		'''
+		max_error = 0.0
+		total_error = 0.0
+		max_voltage = None
+		points = 0
+		for index in range(int((self.end - self.start) / step) + 1):
+			voltage = self.start + index * step
+			table = self.lookup(voltage)
+			try:
+				exact = steinhart_hart(voltage, self.probe_profile)
+			except (ValueError, ZeroDivisionError, OverflowError):
+				continue
+			if table is None or not (0 <= (exact[0] - 273.15) * (9/5) + 32 <= 600):
+				continue
+			error = abs(table[0] - exact[0]) * (9/5 if units == 'F' else 1)
+			total_error += error
+			points += 1
+			if error > max_error:
+				max_error = error
+				max_voltage = voltage
+		return {
+			'max_error' : max_error,
+			'mean_error' : total_error / points if points else 0.0,
+			'max_error_voltage' : max_voltage,
+			'points' : points,
+			'units' : units
+		}
+
 class ProbeInterface:
+	bus_type = None  # Type of bus the device is on (i.e. 'i2c' or 'spi'), set by the device modules
 
 	def __init__(self, probe_info, device_info, units):
 		self.units = units 
 		self.device_info = device_info
+		self.queue_lock = threading.Lock()  # Guards the port queues (read_all_ports may run on an acquisition thread)
 		self.set_profiles(probe_info)
 		self._build_port_map(probe_info)
 		self._build_output_data(probe_info)
-		self._build_ports()
+		self._build_ports(probe_info)
 		self.primary_port = None
 		self.food_ports = []
 		self.aux_ports = []
@@ -72,7 +238,8 @@ class ProbeInterface:
 			'primary' : {},
 			'food' : {},
 			'aux' : {}, 
-			'tr' : {}
+			'tr' : {},
+			'rate' : {}
 		}
 		for probe in probe_info:
 			if probe['device'] == self.device_info['device']:
@@ -86,11 +253,31 @@ class ProbeInterface:
 		for port in self.port_map:
 			self.output_data['tr'][self.port_map[port]] = 0
 
-	def _build_ports(self):
+	def _build_ports(self, probe_info):
 		''' Build ports objects. '''
 		self.port_queues = {}
+		self.port_filters = self._port_filters(probe_info)
 		for port in self.port_map:
-			self.port_queues[port] = TempQueue(qlength=10, units=self.units)
+			self.port_queues[port] = self._new_port_queue(self.port_filters.get(port, {}))
+
+	def _port_filters(self, probe_info):
+		'''
+		Smoothing settings for each port, from the probe info: the averaging queue length (optional 'queue_length'),
+		or a filter (optional 'filter', see temp_filter.py) which also estimates the rate of change.
+		'''
+		port_filters = {}
+		for probe in probe_info:
+			if probe['device'] == self.device_info['device']:
+				port_filters[probe['port']] = {
+					'queue_length' : int(probe.get('queue_length', DEFAULT_QUEUE_LENGTH)),
+					'filter' : probe.get('filter', None)
+				}
+		return port_filters
+
+	def _new_port_queue(self, port_filter):
+		if port_filter.get('filter', None):
+			return TempFilter(config=port_filter['filter'], units=self.units)
+		return TempQueue(qlength=port_filter.get('queue_length', DEFAULT_QUEUE_LENGTH), units=self.units)
 
 	def _temp_to_resistance(self, temp, probe_profile):
 		'''
@@ -122,64 +309,25 @@ class ProbeInterface:
 
 		return Tr 
 
-	def _voltage_to_temp(self, voltage, probe_profile):
-		''' Check to make sure voltage is between 0V and Vs defined in profile, plus some guard band '''
-		if(voltage > 0) and (voltage <= ((probe_profile['Vs'] * 1000) * 1.01)):
-			'''
-				Voltage at the divider (i.e. input to the ADC)
-			'''
-			Vo = (voltage / 1000) # mV to V of ADC (at the divider)
-			
-			'''
-			Thermistor Resistor Value Ohms (R1)
-			 R1 = ( (Vin * R2) - (Vout * R2) ) / Vout
-			 Tr = ((probe_profile['Vs'] * probe_profile['Rd']) - (Vo * probe_profile['Rd'])) / Vo
-			 R2 = ( Vout * R1 ) / ( Vin - Vout )
-			'''
-			
-			if Vo < probe_profile['Vs']:
-				Tr = ( Vo * probe_profile['Rd']) / ( probe_profile['Vs'] - Vo )
-			else:
-				Tr = ( Vo * probe_profile['Rd']) / ( 0.001 )
-
-			''' Coefficient a, b, & c values '''
-			a = probe_profile['A']
-			b = probe_profile['B']
-			c = probe_profile['C']
-
-			'''
-		    Steinhart Hart Equation
-			 1/T = A + B(ln(R)) + C(ln(R))^3
-			 T = 1/(a + b[ln(ohm)] + c[ln(ohm)]^3)
-			'''
-			lnohm = math.log(Tr) # ln(ohms)
-
-			t1 = (b*lnohm) # b[ln(ohm)]
+	def _voltage_to_temp(self, voltage, probe_profile, table=None):
+		''' 
+		Check to make sure voltage is between 0V and Vs defined in profile, plus some guard band 
 
-			t2 = c * math.pow(lnohm,3) # c[ln(ohm)]^3
-
-			tempK = 1/(a + t1 + t2) # calculate temperature in Kelvin
-
-			tempC = tempK - 273.15 # Kelvin to Celsius
-
-			tempF = tempC * (9/5) + 32 # Celsius to Farenheit
-			
-			''' Check bounds for realistic temperature values (0-600F), else report 0F '''
-			if (tempF < 0) or (tempF > 600):
-				tempF = 0
-
-		else:
-			tempF = 0.0
-			tempC = 0.0
-			Tr = 0
-			error_event = f'An error occurred reading the voltage from one of the ports. The voltage read ({voltage}mV) ' \
-				f'was outside the expected range of 0mV to {probe_profile["Vs"] * 1000}mV'	
-			self.logger.error(error_event)
-
-		if self.units == 'F':
-			return tempF, round(Tr)  # Return Calculated Temperature and Thermistor Value in Ohms
-		else: 
-			return tempC, round(Tr)  # Return Calculated Temperature and Thermistor Value in Ohms
+		:param table: ProfileTable for the profile (None to use the exact formula)
+		'''
+		if(voltage > 0) and (voltage <= ((probe_profile['Vs'] * 1000) * 1.01)):
+			''' Look up the temperature in the profile's table, or calculate it if the voltage is outside the table '''
+			if table is not None:
+				output = table.convert(voltage, self.units)
+				if output is not None:
+					return output
+			tempK, Tr = steinhart_hart(voltage, probe_profile)
+			return probe_output(tempK, Tr, self.units)  # Return Calculated Temperature and Thermistor Value in Ohms
+
+		error_event = f'An error occurred reading the voltage from one of the ports. The voltage read ({voltage}mV) ' \
+			f'was outside the expected range of 0mV to {probe_profile["Vs"] * 1000}mV'	
+		self.logger.error(error_event)
+		return 0.0, 0
 
 	def read_all_ports(self, output_data):
 		port_values = {}
@@ -189,18 +337,22 @@ class ProbeInterface:
 			port_values[port] = self.device.read_voltage(port)
 
 			''' Convert Voltage to Temperature and Tr '''
-			port_values[port], self.output_data['tr'][self.port_map[port]] = self._voltage_to_temp(port_values[port], self.probe_profiles[port])
-
-			''' Enqueue the Temperature Readings to Port Queues '''
-			self.port_queues[port].enqueue(port_values[port])
-
-			''' Get average temperature from the queue and store it in the output data structure'''
-			if port == self.primary_port:
-				self.output_data['primary'][self.port_map[port]] = self.port_queues[port].average()
-			elif port in self.food_ports:
-				self.output_data['food'][self.port_map[port]] = self.port_queues[port].average()
-			elif port in self.aux_ports:
-				self.output_data['aux'][self.port_map[port]] = self.port_queues[port].average()
+			port_values[port], self.output_data['tr'][self.port_map[port]] = self._voltage_to_temp(port_values[port], self.probe_profiles[port], self.profile_tables.get(port, None))
+
+			''' Enqueue the Temperature Readings to Port Queues (the device read above is outside of the lock) '''
+			with self.queue_lock:
+				port_queue = self.port_queues[port]
+				port_queue.enqueue(port_values[port])
+				if isinstance(port_queue, TempFilter):
+					self.output_data['rate'][self.port_map[port]] = port_queue.rate()
+
+				''' Get average temperature from the queue and store it in the output data structure'''
+				if port == self.primary_port:
+					self.output_data['primary'][self.port_map[port]] = port_queue.average()
+				elif port in self.food_ports:
+					self.output_data['food'][self.port_map[port]] = port_queue.average()
+				elif port in self.aux_ports:
+					self.output_data['aux'][self.port_map[port]] = port_queue.average()
 
 			if self.time_delay:
 				time.sleep(self.time_delay)  # Time delay, if needed for single-shot mode on some ADC's
@@ -213,17 +365,110 @@ class ProbeInterface:
 
 	def set_profiles(self, probe_info):
 		''' Set the probe profile for each of the probes. '''
-		self.probe_profiles = {}
+		probe_profiles = {}
 		for port in self.device_info['ports']:
 			for probe in probe_info:
 				if probe['device'] == self.device_info['device'] and probe['port'] == port:
-					self.probe_profiles[port] = probe['profile']
-					self.probe_profiles[port]['Rd'] = int(self.device_info['config'].get(port + '_rd', 10000))
-					self.probe_profiles[port]['Vs'] = float(self.device_info['config'].get('voltage_ref', 3.28))
+					probe_profiles[port] = probe['profile']
+					probe_profiles[port]['Rd'] = int(self.device_info['config'].get(port + '_rd', 10000))
+					probe_profiles[port]['Vs'] = float(self.device_info['config'].get('voltage_ref', 3.28))
+		''' Build the voltage to temperature table for each of the probes (thermistor profiles only) '''
+		profile_tables = {}
+		for port, profile in probe_profiles.items():
+			if all(key in profile for key in ('A', 'B', 'C', 'Rd', 'Vs')):
+				profile_tables[port] = ProfileTable(profile)
+		self.probe_profiles = probe_profiles  # Swap in complete profiles (may be read from an acquisition thread)
+		self.profile_tables = profile_tables
+
+		''' Apply any change to the averaging queue lengths / filters '''
+		if hasattr(self, 'port_queues'):
+			port_filters = self._port_filters(probe_info)
+			with self.queue_lock:
+				for port, port_filter in port_filters.items():
+					if port not in self.port_queues:
+						continue
+					if port_filter['filter'] != self.port_filters.get(port, {}).get('filter', None):
+						self.port_queues[port] = self._new_port_queue(port_filter)
+						self.output_data['rate'].pop(self.port_map[port], None)
+					else:
+						self.port_queues[port].set_length(port_filter['queue_length'])
+				self.port_filters = port_filters
+
+	def get_table_accuracy(self, units=None):
+		''' Accuracy of each port's voltage to temperature table against the exact formula, by probe label '''
+		units = self.units if units is None else units
+		return { self.port_map.get(port, port) : table.accuracy(units) for port, table in self.profile_tables.items() }
 
 	def get_port_map(self):
 		return self.port_map
 
+	def get_bus(self):
+		'''
+		Bus that the device is on.  Devices on the same bus are read one after another in concurrent reads, while
+		devices on different buses are read in parallel.  Set with 'bus' in the device config, otherwise from the bus
+		type and number (i.e. 'i2c-1'), or the device name for devices that don't share a bus.
+		'''
+		config = self.device_info['config']
+		if config.get('bus', ''):
+			return str(config['bus'])
+		if self.bus_type is None:
+			return self.device_info['device']
+		return f'{self.bus_type}-{config.get(self.bus_type + "_bus", DEFAULT_BUS_NUMBER.get(self.bus_type, 0))}'
+
+class VirtualProbeInterface(ProbeInterface):
+	'''
+	Base class for the virtual probe devices, which combine the temperatures of other probes (by label).  ProbesMain
+	evaluates the virtual probes in dependency order, using the function returned by compile().
+	'''
+
+	def get_dependencies(self):
+		''' Labels of the probes used by this device '''
+		return list(self.device_info['config'].get('probes_list', []))
+
+	def combine(self, temps):
+		''' Combine the temperatures of the probes used (in the order of get_dependencies()) '''
+		raise NotImplementedError
+
+	def compile(self, label_index):
+		'''
+		Build the function that calculates this device's temperature from a list of probe temperatures
+
+		:param label_index: Dictionary of probe label to the index of its temperature in the list
+		:return: Function of the list of temperatures
+		'''
+		indexes = [label_index[label] for label in self.get_dependencies() if label in label_index]
+		combine = self.combine
+
+		def evaluate(values):
+			temps = [values[index] for index in indexes]
+			return combine(temps) if temps else 0
+
+		return evaluate
+
+	def read_all_ports(self, output_data):
+		''' Calculate the temperature from the probe data read so far (i.e. for use outside of ProbesMain) '''
+		label_index = {}
+		values = []
+		for group in ('primary', 'food', 'aux'):
+			for label, temp in output_data[group].items():
+				if label not in label_index:
+					label_index[label] = len(values)
+					values.append(temp)
+		temp = self.compile(label_index)(values)
+
+		for port in self.port_map:
+			if port == self.primary_port:
+				self.output_data['primary'][self.port_map[port]] = temp
+			elif port in self.food_ports:
+				self.output_data['food'][self.port_map[port]] = temp
+			elif port in self.aux_ports:
+				self.output_data['aux'][self.port_map[port]] = temp
+
+			''' Set Tr value to 0 since we are combining temperature outputs '''
+			self.output_data['tr'][self.port_map[port]] = 0
+
+		return self.output_data
+
 class FakeDevice:
 
 	def __init__(self, port_map, primary_port, units):
@@ -9,6 +9,33 @@ Description:
   This module is the high level module that reports temperatures from 
   the device(s) hardware.  
 
+  With threaded acquisition enabled, each (non-virtual) probe device is 
+  sampled on its own thread at the configured sample period, into a ring 
+  buffer of recent samples.  read_probes() then returns the latest sample 
+  from each device without waiting on the hardware, and only the virtual 
+  probe devices (which combine the other probes) are calculated inline.  
+  A device whose latest sample is older than the sample period plus the 
+  device timeout (i.e. a failing or hung device) is listed in stale_devices.  
+
+  With concurrent reads enabled (and threaded acquisition disabled), the 
+  devices are grouped by bus (i.e. I2C, SPI), and each bus is read by its 
+  own worker thread, so that devices on different buses are read in 
+  parallel.  read_probes() waits for each bus up to the device timeout 
+  for each device on it.  A device that doesn't return data in time (i.e. 
+  a hung device) is reported with its last data, and is listed in 
+  stale_devices, so that the control loop isn't stalled.  A bus that is 
+  still busy with an earlier read isn't waited on again, and its devices 
+  are listed in stale_devices until the read completes.  
+
+  The stale devices are reported by get_stale_devices() (i.e. in the 
+  control status).  
+
+  The virtual probe devices are put in dependency order when the devices are 
+  set up, so that a virtual probe that uses another virtual probe is 
+  calculated after it, regardless of the order of the devices in the probe 
+  map.  Each virtual device is compiled to a function that reads the 
+  temperatures it uses from a list, by precomputed index.  
+
 '''
 
 '''
@@ -18,15 +45,31 @@ Description:
 '''
 import importlib
 import logging
+import threading
+import time
+from collections import deque
+from probes.base import VirtualProbeInterface
+
+SAMPLE_BUFFER_LENGTH = 32  # Number of samples kept per device in threaded acquisition
 
 class ProbesMain:
 
-	def __init__(self, probe_map, units):
+	def __init__(self, probe_map, units, acquisition={}):
 		self.logger = logging.getLogger("control")
 		self.units = units 
 		self.probe_devices = probe_map['probe_devices']
 		self.probe_info = probe_map['probe_info']
+		self.acquisition = { 'threaded' : False, 'sample_period' : 0.1, 'concurrent' : False, 'device_timeout' : 0.5 }
+		self.acquisition.update(acquisition)
+		self.sample_buffers = {}  # Ring buffer of (timestamp, data) samples for each threaded device (by index)
+		self.acquisition_threads = []
+		self.buses = []  # Devices and worker thread for each bus, in concurrent reads
+		self.last_data = {}  # Last (timestamp, data) read from each device (by index), in concurrent reads
+		self.stale_devices = {}  # Devices that didn't return data in time, with the age in seconds of the data used
+		self.acquisition_stop = threading.Event()
 		self._setup_probe_devices(self.probe_devices)
+		self._log_table_accuracy()
+		self._start_acquisition()
 	
 	def _setup_probe_devices(self, probe_devices):
 		error_event = None
@@ -54,32 +97,264 @@ class ProbesMain:
 			'''
 			self.probe_device_list.append(instance)
 
+		''' Order of the probes in the output data (device order, as if the devices were read in order) '''
+		self.output_order = { 'primary' : [], 'food' : [], 'aux' : [], 'tr' : [] }
+		for device in self.probe_device_list:
+			for group in self.output_order:
+				self.output_order[group].extend(device.output_data[group])
+
+		graph_error = self._build_virtual_graph()
+		return error_event if error_event else graph_error
+
+	def _build_virtual_graph(self):
+		'''
+		Order the virtual probe devices so that each is calculated after the probes it uses, and compile them
+		'''
+		error_event = None
+		groups = { 'Primary' : 'primary', 'Food' : 'food', 'Aux' : 'aux' }
+		self.label_groups = {}  # Output group of each probe label
+		for probe in self.probe_info:
+			if probe['type'] in groups and probe['label'] not in self.label_groups:
+				self.label_groups[probe['label']] = groups[probe['type']]
+		self.label_index = { label : index for index, label in enumerate(self.label_groups) }
+
+		''' Find the virtual devices that each virtual device depends on '''
+		virtual_devices = { index : device for index, device in enumerate(self.probe_device_list)
+			if isinstance(device, VirtualProbeInterface) }
+		producers = {}
+		for index, device in virtual_devices.items():
+			for label in device.get_port_map().values():
+				producers[label] = index
+		depends_on = {}
+		for index, device in virtual_devices.items():
+			depends_on[index] = set(producers[label] for label in device.get_dependencies() if label in producers)
+
+		''' Topological sort (devices left over are in a dependency loop) '''
+		order = []
+		remaining = dict(depends_on)
+		while remaining:
+			ready = [index for index, depends in remaining.items() if not depends & remaining.keys()]
+			if not ready:
+				break
+			for index in ready:
+				order.append(index)
+				del remaining[index]
+
+		self.virtual_graph = []
+		for index in order + list(remaining):
+			device = virtual_devices[index]
+			outputs = [(self.label_index[label], self.label_groups[label], label)
+				for label in device.get_port_map().values() if label in self.label_index]
+			evaluate = None
+			if index in remaining:
+				error_event = f'The virtual probe device [{device.device_info["device"]}] depends on itself (through ' \
+					f'its probes, or other virtual probes).  Its temperature will be reported as 0.'
+				self.logger.error(error_event)
+			else:
+				try:
+					evaluate = device.compile(self.label_index)
+				except:
+					error_event = f'An error occurred setting up the virtual probe device [{device.device_info["device"]}].'
+					self.logger.exception(error_event)
+			self.virtual_graph.append((evaluate, outputs))
+		self.virtual_devices = set(virtual_devices)
 		return error_event
 
+	def _read_virtual_probes(self, output_data):
+		''' Calculate the virtual probes, in dependency order '''
+		values = [0] * len(self.label_index)
+		for label, group in self.label_groups.items():
+			values[self.label_index[label]] = output_data[group].get(label, 0)
+		for evaluate, outputs in self.virtual_graph:
+			temp = 0
+			if evaluate is not None:
+				try:
+					temp = evaluate(values)
+				except (ArithmeticError, ValueError):
+					temp = 0  # i.e. divide by zero while a probe is reading 0
+			for index, group, label in outputs:
+				values[index] = temp
+				output_data[group][label] = temp
+				output_data['tr'][label] = 0
+
 	def read_probes(self):
 		'''
 		Loop through all probe devices and get all data
 		'''
-		output_data = {
-			'primary' : {},
-			'food' : {},
-			'aux' : {}, 
-			'tr' : {}
-		}
-		for device in self.probe_device_list:
-			device_data = device.read_all_ports(output_data)
+		output_data = { group : dict.fromkeys(labels, 0) for group, labels in self.output_order.items() }
+		output_data['rate'] = {}
+		if self.buses:
+			self._read_buses()
+		now = time.time()
+		for index, device in enumerate(self.probe_device_list):
+			if index in self.virtual_devices:
+				continue
+			buffer = self.sample_buffers.get(index, None)
+			if buffer:
+				sample_time, device_data = buffer[-1]  # Latest sample from the acquisition thread
+				self._check_stale(index, sample_time, now - self.acquisition['sample_period'] - self.acquisition['device_timeout'], now)
+			elif index in self.last_data:
+				device_data = self.last_data[index][1]  # Latest data from the bus worker thread
+			else:
+				device_data = device.read_all_ports(output_data)
 			for group in device_data:
 				for probe in device_data[group]:
 					output_data[group][probe] = device_data[group][probe]
+		if self.virtual_graph:
+			self._read_virtual_probes(output_data)
 
 		return output_data
 
 	def update_probe_map(self, probe_map):
+		self._stop_acquisition()
 		self.probe_devices = probe_map['probe_devices']
 		self.probe_info = probe_map['probe_info']
 		error = self._setup_probe_devices(self.probe_devices)
+		self._start_acquisition()
 		return error
 
 	def update_probe_profiles(self, probe_info):
 		for device in self.probe_device_list:
-			device.set_profiles(probe_info)
\ No newline at end of file
+			device.set_profiles(probe_info)
+		self._log_table_accuracy()
+
+	def get_stale_devices(self):
+		''' Devices that didn't return data in time, with the age in seconds of the data used '''
+		return dict(self.stale_devices)
+
+	def get_table_accuracy(self):
+		''' Accuracy report of the probe profile tables of all devices, by probe label '''
+		report = {}
+		for device in self.probe_device_list:
+			report.update(device.get_table_accuracy())
+		return report
+
+	def _log_table_accuracy(self):
+		''' Log the accuracy of the probe profile tables (debug logging only, since the report takes a while) '''
+		if not self.logger.isEnabledFor(logging.DEBUG):
+			return
+		for label, accuracy in self.get_table_accuracy().items():
+			self.logger.debug(f'Probe profile table [{label}]: max error {accuracy["max_error"]:.3f}{accuracy["units"]} '
+				f'at {accuracy["max_error_voltage"]} mV, mean error {accuracy["mean_error"]:.3f}{accuracy["units"]} '
+				f'({accuracy["points"]} points)')
+
+	def update_acquisition(self, acquisition):
+		''' Change the acquisition mode / sample period, restarting the acquisition threads '''
+		self._stop_acquisition()
+		self.acquisition.update(acquisition)
+		self._start_acquisition()
+
+	def stop(self):
+		self._stop_acquisition()
+
+	def _start_acquisition(self):
+		if not self.acquisition['threaded']:
+			if self.acquisition['concurrent']:
+				self._start_bus_workers()
+			return
+		self.acquisition_stop = threading.Event()
+		for index, device in enumerate(self.probe_device_list):
+			# Virtual devices depend on the other devices' data, so they are calculated in read_probes()
+			if self.probe_devices[index]['module'].startswith('virtual'):
+				continue
+			buffer = deque(maxlen=SAMPLE_BUFFER_LENGTH)
+			self._acquire_sample(device, buffer)  # Take the first sample now, so that read_probes() always has data
+			self.sample_buffers[index] = buffer
+			thread = threading.Thread(target=self._acquisition_loop, args=(device, buffer, self.acquisition_stop), 
+				name=f'probes-{self.probe_devices[index]["device"]}', daemon=True)
+			thread.start()
+			self.acquisition_threads.append(thread)
+
+	def _stop_acquisition(self):
+		self.acquisition_stop.set()
+		for thread in self.acquisition_threads:
+			thread.join(timeout=self.acquisition['sample_period'] + 1)
+		self.acquisition_threads = []
+		self.sample_buffers = {}
+		for bus in self.buses:
+			bus['request'].set()  # Wake the worker, so that it sees the stop event
+			bus['thread'].join(timeout=self.acquisition['device_timeout'])
+		self.buses = []
+		self.last_data = {}
+		self.stale_devices = {}
+
+	def _acquisition_loop(self, device, buffer, stop):
+		sample_period = self.acquisition['sample_period']
+		next_sample = time.monotonic() + sample_period
+		while not stop.wait(max(next_sample - time.monotonic(), 0)):
+			self._acquire_sample(device, buffer)
+			next_sample += sample_period
+			if next_sample < time.monotonic():
+				next_sample = time.monotonic()  # Running behind (i.e. slow device), so don't try to catch up
+
+	def _acquire_sample(self, device, buffer):
+		try:
+			device_data = device.read_all_ports({ 'primary' : {}, 'food' : {}, 'aux' : {}, 'tr' : {}, 'rate' : {} })
+			buffer.append((time.time(), self._copy_data(device_data)))
+		except:
+			self.logger.exception(f'Exception occurred while sampling probe device {device.device_info["device"]}.  Trace dump: ')
+
+	def _start_bus_workers(self):
+		''' Group the (non-virtual) devices by bus, and start a worker thread for each bus '''
+		self.acquisition_stop = threading.Event()
+		devices_by_bus = {}
+		for index, device in enumerate(self.probe_device_list):
+			if self.probe_devices[index]['module'].startswith('virtual'):
+				continue
+			devices_by_bus.setdefault(device.get_bus(), []).append(index)
+			self.last_data[index] = (time.time(), self._copy_data(device.output_data))
+		for name, devices in devices_by_bus.items():
+			bus = { 'name' : name, 'devices' : devices, 'request' : threading.Event(), 'done' : threading.Event() }
+			bus['done'].set()  # Ready for the first read
+			bus['thread'] = threading.Thread(target=self._bus_loop, args=(bus, self.last_data, self.acquisition_stop), 
+				name=f'probes-{name}', daemon=True)
+			bus['thread'].start()
+			self.buses.append(bus)
+
+	def _bus_loop(self, bus, last_data, stop):
+		while True:
+			bus['request'].wait()
+			if stop.is_set():
+				return
+			bus['request'].clear()
+			for index in bus['devices']:
+				device = self.probe_device_list[index]
+				try:
+					last_data[index] = (time.time(), self._copy_data(device.read_all_ports({ 'primary' : {}, 'food' : {}, 'aux' : {}, 'tr' : {}, 'rate' : {} })))
+				except:
+					self.logger.exception(f'Exception occurred while reading probe device {device.device_info["device"]}.  Trace dump: ')
+			bus['done'].set()
+
+	def _read_buses(self):
+		''' Read all buses in parallel, waiting up to the device timeout for each device on the bus '''
+		started = time.time()
+		start = time.monotonic()
+		dispatched = []
+		for bus in self.buses:
+			# Otherwise, the worker is still busy with an earlier read (i.e. a hung device), so its devices are stale
+			if bus['done'].is_set():
+				bus['done'].clear()
+				bus['request'].set()
+				dispatched.append(bus)
+		for bus in dispatched:
+			bus['done'].wait(max(start + self.acquisition['device_timeout'] * len(bus['devices']) - time.monotonic(), 0))
+
+		''' Flag the devices that weren't read in time '''
+		now = time.time()
+		for bus in self.buses:
+			for index in bus['devices']:
+				self._check_stale(index, self.last_data[index][0], started, now)
+
+	def _check_stale(self, index, sample_time, oldest, now):
+		''' Flag a device as stale if its data is older than the oldest time allowed, or clear the flag '''
+		name = self.probe_devices[index]['device']
+		if sample_time < oldest:
+			if name not in self.stale_devices:
+				self.logger.error(f'Probe device {name} did not return data in time.  Using its last data.')
+			self.stale_devices[name] = round(now - sample_time, 3)
+		else:
+			self.stale_devices.pop(name, None)
+
+	def _copy_data(self, device_data):
+		''' Copy the data, since the device reuses its output structure for the next read '''
+		return { group : dict(values) for group, values in device_data.items() }
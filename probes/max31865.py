@@ -185,6 +185,7 @@ class RTDDevice():
 		self.spi.close()
 
 class ReadProbes(ProbeInterface):
+	bus_type = 'spi'
 
 	def __init__(self, probe_info, device_info, units):
 		super().__init__(probe_info, device_info, units)
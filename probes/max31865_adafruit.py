@@ -89,6 +89,7 @@ class RTDDevice():
 		return self.sensor.resistance
 
 class ReadProbes(ProbeInterface):
+	bus_type = 'spi'
 
 	def __init__(self, probe_info, device_info, units):
 		super().__init__(probe_info, device_info, units)
@@ -70,6 +70,7 @@ class KTTDevice():
 		return self.sensor.temperature
 
 class ReadProbes(ProbeInterface):
+	bus_type = 'i2c'
 
 	def __init__(self, probe_info, device_info, units):
 		super().__init__(probe_info, device_info, units)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+'''
+	Low-latency alternative to the TempQueue moving average, for smoothing the temperature from a port.
+
+	The filter tracks the temperature and its rate of change (degrees per second), so that the smoothed temperature
+	doesn't lag behind a rising or falling temperature the way a moving average does.  Two filter types are
+	available:
+
+		'kalman' : Constant-velocity Kalman filter.  The gains adapt to the time between readings and to the
+			noise model:
+				'measurement_noise' : Standard deviation of a single reading (degrees)
+				'process_noise' : Standard deviation of the change in the rate of change (degrees/s^2)
+		'alpha_beta' : Fixed gain alpha-beta filter (cheaper, but the gains don't adapt):
+				'alpha' : Temperature gain (0 - 1, lower is smoother)
+				'beta' : Rate of change gain (0 - 1, lower is smoother)
+
+	Instead of holding the last average when the readings are noisy, readings that are too far from the predicted
+	temperature ('gate' standard deviations of the expected error) are rejected.  If several readings in a row are
+	rejected ('max_rejects'), the temperature really changed (i.e. a probe was plugged in), and the filter restarts
+	from the new reading.
+
+	Ex. Probe Info:
+
+		{
+			...
+			'filter' : { 'type' : 'kalman', 'measurement_noise' : 1.5, 'process_noise' : 0.05 }
+		}
+'''
+
+import time
+
+''' Default settings for each of the units (degrees F / degrees C) '''
+FILTER_DEFAULTS = {
+	'F' : {
+		'type' : 'kalman',
+		'measurement_noise' : 1.5,
+		'process_noise' : 0.05,
+		'alpha' : 0.3,
+		'beta' : 0.02,
+		'gate' : 4.0,
+		'max_rejects' : 3
+	},
+	'C' : {
+		'type' : 'kalman',
+		'measurement_noise' : 0.8,
+		'process_noise' : 0.03,
+		'alpha' : 0.3,
+		'beta' : 0.02,
+		'gate' : 4.0,
+		'max_rejects' : 3
+	}
+}
+
+FILTER_TYPES = ['kalman', 'alpha_beta']
+MIN_TIME_STEP = 0.001  # Minimum time between readings used by the filter (seconds)
+
+class TempFilter():
+	def __init__(self, config={}, units='F', clock=time.monotonic):
+		self.units = units
+		self.clock = clock
+		self.config = FILTER_DEFAULTS['F' if units == 'F' else 'C'].copy()
+		self.config.update(config)
+		if self.config['type'] not in FILTER_TYPES:
+			raise ValueError(f'Unknown probe filter type ({self.config["type"]}).  Supported types are {FILTER_TYPES}.')
+
+		self.r = self.config['measurement_noise'] ** 2  # Measurement variance
+		self.q = self.config['process_noise'] ** 2  # Process (rate of change) variance
+		self.rejects = 0
+		self.reset()
+
+	def reset(self):
+		''' Restart the filter at the next reading '''
+		self.temp = None
+		self.temp_rate = 0.0
+		self.last_time = None
+		self.p = [[0.0, 0.0], [0.0, 0.0]]  # Kalman error covariance of [temperature, rate of change]
+
+	def enqueue(self, value):
+		now = self.clock()
+		if self.temp is None:
+			self._start(value, now)
+			return(self.average())
+
+		dt = max(now - self.last_time, MIN_TIME_STEP)
+		self.last_time = now
+		if self.config['type'] == 'kalman':
+			self._kalman(value, dt)
+		else:
+			self._alpha_beta(value, dt)
+		return(self.average())
+
+	def average(self):
+		if self.temp is None:
+			return(0)
+		if self.units == 'F':
+			return(int(self.temp))  # Give integer for F units
+		else:
+			return(round(self.temp, 1))  # Give one digit of decimal for C units
+
+	def rate(self):
+		''' Rate of change of the temperature (degrees per second) '''
+		return round(self.temp_rate, 3)
+
+	def set_length(self, qlength):
+		''' No queue to resize (the smoothing is set by the noise model / gains) '''
+		pass
+
+	def _start(self, value, now):
+		self.temp = float(value)
+		self.temp_rate = 0.0
+		self.last_time = now
+		self.rejects = 0
+		# Start with the temperature known to the measurement noise, and the rate of change unknown
+		self.p = [[self.r, 0.0], [0.0, self.r]]
+
+	def _reject(self, error, variance):
+		''' Check if a reading is too far from the prediction '''
+		if error * error <= self.config['gate'] ** 2 * variance:
+			self.rejects = 0
+			return False
+		self.rejects += 1
+		return True
+
+	def _kalman(self, value, dt):
+		''' Predict (constant rate of change) '''
+		temp = self.temp + self.temp_rate * dt
+		(p00, p01), (p10, p11) = self.p
+		# Process noise for a random change in the rate of change (white noise acceleration)
+		q00 = self.q * dt ** 3 / 3
+		q01 = self.q * dt ** 2 / 2
+		q11 = self.q * dt
+		p00 = p00 + dt * (p01 + p10) + dt * dt * p11 + q00
+		p01 = p01 + dt * p11 + q01
+		p11 = p11 + q11
+
+		''' Update with the reading '''
+		error = value - temp
+		s = p00 + self.r
+		if self._reject(error, s):
+			if self.rejects >= self.config['max_rejects']:
+				self._start(value, self.last_time)  # Too many rejects, so restart from the new reading
+			else:
+				# Keep the prediction, with the increased uncertainty
+				self.temp = temp
+				self.p = [[p00, p01], [p01, p11]]
+			return
+		k0 = p00 / s
+		k1 = p01 / s
+		self.temp = temp + k0 * error
+		self.temp_rate += k1 * error
+		self.p = [[(1 - k0) * p00, (1 - k0) * p01], [(1 - k0) * p01, p11 - k1 * p01]]
+
+	def _alpha_beta(self, value, dt):
+		temp = self.temp + self.temp_rate * dt
+		error = value - temp
+		# Expected (steady state) error from the measurement noise, and from the error in the predicted temperature
+		if self._reject(error, self.r * 2 / (2 - self.config['alpha'])):
+			if self.rejects >= self.config['max_rejects']:
+				self._start(value, self.last_time)  # Too many rejects, so restart from the new reading
+			else:
+				self.temp = temp
+			return
+		self.temp = temp + self.config['alpha'] * error
+		self.temp_rate += self.config['beta'] * error / dt
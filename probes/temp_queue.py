@@ -1,22 +1,33 @@
 #!/usr/bin/env python3
 
 '''
-	Class to track temperature averages coming from the probes and 
-	handle errors gracefully (hopefully).  
+	Class to track temperature averages coming from the probes and
+	handle errors gracefully (hopefully).
+
+	The queue is a fixed length ring buffer, with the sum and the sum of squared differences from the mean
+	(Welford's method, over the sliding window) kept up to date on each enqueue, so that the average and
+	standard deviation don't need a pass over the queue.
 '''
 
-import statistics
+import math
+from collections import deque
+
+RECALCULATE_INTERVAL = 1000  # Enqueues between exact recalculations of the running values (limits float drift)
 
 class TempQueue():
 	def __init__(self, qlength=10, units='F'):
-		self.queue = []
 		self.units = units
 
 		if qlength < 2:
 			self.qlength = 2 # Set minimum qlength to 2
-		else: 
+		else:
 			self.qlength = qlength
-		
+		self.queue = deque(maxlen=self.qlength)
+		self.sum = 0.0
+		self.mean = 0.0
+		self.m2 = 0.0  # Sum of squared differences from the mean
+		self.updates = 0
+
 		if units == 'F':
 			self.stdev_max = 4.75  # Standard Deviation Maximum for degrees F
 		else:
@@ -24,31 +35,43 @@ class TempQueue():
 		self.last_average = 0
 
 	def enqueue(self, value):
-		while len(self.queue) < (self.qlength + 1):
-			self.queue.insert(0, value)
-		self.queue.pop()
+		if len(self.queue) == 0:
+			# Fill the queue with the first value
+			self.queue.extend([value] * self.qlength)
+			self._recalculate()
+		else:
+			# Replace the oldest value (sliding window update of the mean and squared differences)
+			old_value = self.queue[0]
+			self.queue.append(value)
+			old_mean = self.mean
+			self.sum += value - old_value
+			self.mean = self.sum / self.qlength
+			self.m2 += (value - old_value) * (value - self.mean + old_value - old_mean)
+			self.updates += 1
+			if self.updates >= RECALCULATE_INTERVAL:
+				self._recalculate()
 		return(self.average())
 
 	def average(self):
 		if len(self.queue) < self.qlength:
-			# Handle case if queue isn't full 
+			# Handle case if queue isn't full
 			self.last_average = 0
 			return(0)
 		elif self.last_average == 0:
 			# Handle case if lastaverage isn't initialized
-			average = (sum(self.queue) / self.qlength)
+			average = self.mean
 			self.last_average = average
 			if self.units == 'F':
 				return(int(average))  # Give integer for F units
-			else: 
+			else:
 				return(round(average, 1))  # Give one digit of decimal for C units
 		else:
 			# Handle normal case
 			# Get standard deviation from temperatures in the queue
-			stdev = statistics.stdev(self.queue)
+			stdev = self.stdev()
 			if stdev < self.stdev_max:
 				# If the standard deviation is less than the max deviation, calculate the average temperature as normal
-				average = (sum(self.queue) / self.qlength)
+				average = self.mean
 				self.last_average = average
 			else:
 				# If the standard deviation exceeds the max deviation, keep the last average value
@@ -56,6 +79,32 @@ class TempQueue():
 
 			if self.units == 'F':
 				return(int(average))  # Give integer for F units
-			else: 
+			else:
 				return(round(average, 1))  # Give one digit of decimal for C units
 
+	def stdev(self):
+		''' Sample standard deviation of the temperatures in the queue '''
+		if len(self.queue) < 2:
+			return 0.0
+		return math.sqrt(max(self.m2, 0.0) / (len(self.queue) - 1))
+
+	def set_length(self, qlength):
+		''' Change the queue length, keeping the newest values '''
+		qlength = max(qlength, 2)
+		if qlength == self.qlength:
+			return
+		values = list(self.queue)[-qlength:]
+		self.qlength = qlength
+		self.queue = deque(values, maxlen=qlength)
+		if 0 < len(self.queue) < qlength:
+			# Pad with the oldest value, so that the queue stays full
+			self.queue.extendleft([self.queue[0]] * (qlength - len(self.queue)))
+		self._recalculate()
+
+	def _recalculate(self):
+		''' Exact calculation of the running values from the queue '''
+		count = len(self.queue)
+		self.sum = float(sum(self.queue))
+		self.mean = self.sum / count if count else 0.0
+		self.m2 = sum((value - self.mean) ** 2 for value in self.queue)
+		self.updates = 0
@@ -26,7 +26,7 @@ Description:
 *****************************************
 '''
 
-from probes.base import ProbeInterface
+from probes.base import VirtualProbeInterface
 from statistics import mean
 
 '''
@@ -35,33 +35,11 @@ from statistics import mean
 *****************************************
 '''
 
-class ReadProbes(ProbeInterface):
+class ReadProbes(VirtualProbeInterface):
 
 	def __init__(self, probe_info, device_info, units):
 		super().__init__(probe_info, device_info, units)
-	
-	def read_all_ports(self, output_data):
-		''' Find the probes to average '''
-		for port in self.port_map:
-			temp_list = []
-			for probe in self.device_info['config']['probes_list']:
-				if probe in output_data['primary']:
-					temp_list.append(output_data['primary'][probe])
-				elif probe in output_data['food']:
-					temp_list.append(output_data['food'][probe])
-				elif probe in output_data['aux']:
-					temp_list.append(output_data['aux'][probe])			
-			
-			''' Get average temperature and store it in the output data structure'''
-			if port == self.primary_port:
-				self.output_data['primary'][self.port_map[port]] = mean(temp_list)
-			elif port in self.food_ports:
-				self.output_data['food'][self.port_map[port]] = mean(temp_list)
-			elif port in self.aux_ports:
-				self.output_data['aux'][self.port_map[port]] = mean(temp_list)
-			
-			''' Set Tr value to 0 since we are averaging temperature outputs '''
-			self.output_data['tr'][self.port_map[port]] = 0
-
-		return self.output_data
 
+	def combine(self, temps):
+		''' Average temperature of the probes '''
+		return mean(temps)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+'''
+*****************************************
+PiFire Probes Virtual Probe Expression Module
+*****************************************
+
+Description:
+  This module is a virtual probe device that calculates an arithmetic expression of other probe inputs (i.e. a
+  weighted average).  In the expression, the probes selected in probes_list are p0, p1, p2... (in the order of the
+  list), and probes can also be referred to by label, if the label is a valid name (i.e. Grill1).
+
+  Expressions can use numbers, + - * / // % ** and parentheses, and the functions min, max, abs, round, mean and
+  median.  The expression is checked when the device is set up, and compiled to a function that ProbesMain calls
+  with the probe temperatures.  Powers are calculated in floating point, so that a large power (i.e. a typo like
+  2**9**9) fails with an overflow, instead of calculating an enormous integer in the control loop.
+
+	Ex Device Definition:
+
+	device = {
+			'device' : 'your_device_name',	# Unique name for the device
+			'module' : 'virtual_expression',	# Must be populated for this module to load properly
+			'ports' : ['VIRT0'], 			# A port must be defined, with the labels of the probes to utilize in config data
+			'config' : {
+			  "probes_list" : ["Grill1", "Grill2"],	# List of probe labels to utilize
+			  "expression" : "0.7 * p0 + 0.3 * p1"	# Expression to calculate
+			}
+		}
+'''
+
+'''
+*****************************************
+ Imported Libraries
+*****************************************
+'''
+
+import ast
+import math
+import re
+from statistics import mean, median
+from probes.base import VirtualProbeInterface
+
+'''
+*****************************************
+ Class Definitions
+*****************************************
+'''
+
+FUNCTIONS = {
+	'min' : min,
+	'max' : max,
+	'abs' : abs,
+	'round' : round,
+	'mean' : lambda *temps: mean(temps),
+	'median' : lambda *temps: median(temps)
+}
+
+ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load, ast.Call,
+	ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.UAdd, ast.USub)
+
+PROBES_LIST_NAME = re.compile(r'^p(\d+)$')
+
+def parse_expression(expression):
+	'''
+	Parse and check an expression
+
+	:param expression: Expression string
+	:return: Expression tree
+	:raises ValueError: If the expression is not valid, or uses anything other than numbers, arithmetic and the
+		supported functions
+	'''
+	try:
+		tree = ast.parse(expression, mode='eval')
+	except SyntaxError as error:
+		raise ValueError(f'Invalid expression ({error.msg}).')
+	for node in ast.walk(tree):
+		if not isinstance(node, ALLOWED_NODES):
+			raise ValueError(f'Unsupported item in expression ({type(node).__name__}).')
+		if isinstance(node, ast.Constant) and (isinstance(node.value, bool) or not isinstance(node.value, (int, float))):
+			raise ValueError(f'Unsupported constant in expression ({node.value!r}).')
+		if isinstance(node, ast.Call):
+			if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+				raise ValueError(f'Unsupported function call in expression.  Supported functions are {list(FUNCTIONS)}.')
+	return tree
+
+class _ProbeValues(ast.NodeTransformer):
+	''' Replace the probe names in an expression with lookups of the probe temperatures (by index) '''
+	def __init__(self, indexes):
+		self.indexes = indexes
+
+	def visit_Call(self, node):
+		node.args = [self.visit(arg) for arg in node.args]  # Keep the function name
+		return node
+
+	def visit_BinOp(self, node):
+		self.generic_visit(node)
+		if isinstance(node.op, ast.Pow):
+			# Floating point power (raises OverflowError, instead of growing without bound like an integer power)
+			return ast.copy_location(ast.Call(func=ast.Name(id='_power', ctx=ast.Load()), args=[node.left, node.right],
+				keywords=[]), node)
+		return node
+
+	def visit_Name(self, node):
+		return ast.copy_location(ast.Subscript(value=ast.Name(id='values', ctx=ast.Load()),
+			slice=ast.Constant(value=self.indexes[node.id]), ctx=ast.Load()), node)
+
+class ReadProbes(VirtualProbeInterface):
+
+	def __init__(self, probe_info, device_info, units):
+		super().__init__(probe_info, device_info, units)
+		self.expression = self.device_info['config'].get('expression', '')
+		try:
+			self.tree = parse_expression(self.expression)
+		except ValueError as error:
+			self.logger.error(f'Virtual probe device [{self.device_info["device"]}]: {error}  Expression: {self.expression}')
+			self.tree = None
+
+	def get_dependencies(self):
+		''' Labels of the probes used in the expression '''
+		if self.tree is None:
+			return []
+		probes_list = self.device_info['config'].get('probes_list', [])
+		dependencies = []
+		for node in ast.walk(self.tree):
+			if isinstance(node, ast.Name) and node.id not in FUNCTIONS:
+				label = self._label(node.id, probes_list)
+				if label not in dependencies:
+					dependencies.append(label)
+		return dependencies
+
+	def compile(self, label_index):
+		'''
+		Compile the expression to a function of the list of probe temperatures
+
+		:raises ValueError: If the expression uses a probe that doesn't exist
+		'''
+		if self.tree is None:
+			return lambda values: 0
+		probes_list = self.device_info['config'].get('probes_list', [])
+		indexes = {}
+		for node in ast.walk(self.tree):
+			if isinstance(node, ast.Name) and node.id not in indexes:
+				label = self._label(node.id, probes_list)
+				if label in label_index:
+					indexes[node.id] = label_index[label]
+				elif node.id not in FUNCTIONS:
+					raise ValueError(f'Unknown probe ({label}) in the expression of virtual probe device [{self.device_info["device"]}].')
+		body = _ProbeValues(indexes).visit(ast.parse(self.expression, mode='eval')).body
+		function = ast.Expression(body=ast.Lambda(args=ast.arguments(posonlyargs=[], args=[ast.arg(arg='values')],
+			kwonlyargs=[], kw_defaults=[], defaults=[]), body=body))
+		ast.fix_missing_locations(function)
+		return eval(compile(function, f'<{self.device_info["device"]}>', 'eval'), { '__builtins__' : {}, '_power' : math.pow, **FUNCTIONS })
+
+	def _label(self, name, probes_list):
+		''' Probe label for a name in the expression (p0, p1... are the probes in the probes list) '''
+		match = PROBES_LIST_NAME.match(name)
+		if match and int(match.group(1)) < len(probes_list):
+			return probes_list[int(match.group(1))]
+		return name
@@ -103,7 +103,9 @@ function refreshChart() {
 	// Load graph data and update page 
 	var postdata = { 
 		'full_graph' : true,
-		'filename' : cookfilename	
+		'filename' : cookfilename,
+		// Downsample to about two points per pixel of chart width
+		'data_points' : document.getElementById('HistoryChart') ? document.getElementById('HistoryChart').clientWidth * 2 : 0
 	};
 	req = $.ajax({
 		url : '/cookfiledata',
@@ -5,6 +5,8 @@ var annotation_enabled = true;
 var paused = false;
 var probe_mapper = {};
 var ui_hash;
+var lastSampleTime = 0;  // Timestamp of the last history sample on the chart
+var annotationCount = 0;  // Number of metrics records (annotations) already on the chart
 
 Chart.defaults.font.family = '"Segoe UI", Roboto, "Helvetica Neue", Arial, "Noto Sans", "Liberation Sans"';
 
@@ -50,7 +52,7 @@ var temperatureCharts = new Chart(document.getElementById('HistoryChart'), {
 						// Replace data in a dataset
 						$("#minutes").val(num_mins);
 						$("#durationWindowInput").val(num_mins);
-						refreshChartData(true);
+						refreshChartData(true, xScale.min, xScale.max);
 					}
 				  },
 				zoom: {
@@ -75,7 +77,7 @@ var temperatureCharts = new Chart(document.getElementById('HistoryChart'), {
 					// Replace data in a dataset
 					$("#minutes").val(num_mins);
 					$("#durationWindowInput").val(num_mins);
-					refreshChartData(true);
+					refreshChartData(true, xScale.min, xScale.max);
 				  }
 				}
 			},
@@ -94,31 +96,40 @@ var temperatureCharts = new Chart(document.getElementById('HistoryChart'), {
 					refresh: 1000,
 					pause: paused,
 					onRefresh: chart => {
-						$.get("/historyupdate/stream", function(data){
+						// Wait for the initial chart data, so that the first update doesn't fetch the whole history
+						if (!chartReady) {
+							return;
+						};
+						// Only fetch the samples and annotations added since the last update
+						$.get("/historyupdate/since", { 't' : lastSampleTime, 'a' : annotationCount }, function(data){
 							checkHashChange(data.ui_hash); 
 							checkModeChange(data.mode);
-							if (chartReady) {
-								var dateNow = Date.now();
-								// append the new label (time) to the label list
-								chart.data.labels.push(dateNow);
-								// append the new data array to the existing chart data
-								//chart.data.datasets[0].data.push(data.probe0_temp);
-								for (probe in data.current.P) {
-									chart.data.datasets[probe_mapper['probes'][probe]].data.push(data.current.P[probe]);
-									chart.data.datasets[probe_mapper['primarysp'][probe]].data.push(data.current.PSP);
+							if (data.reset) {
+								refreshChartData(false);
+							} else if (chartReady) {
+								for (var index = 0; index < data.T.length; index++) {
+									// append the new label (time) to the label list
+									chart.data.labels.push(data.T[index]);
+									// append the new data to the existing chart data
+									for (probe in data.P) {
+										chart.data.datasets[probe_mapper['probes'][probe]].data.push(data.P[probe][index]);
+										chart.data.datasets[probe_mapper['primarysp'][probe]].data.push(data.PSP[index]);
+									};
+									for (probe in data.F) {
+										chart.data.datasets[probe_mapper['probes'][probe]].data.push(data.F[probe][index]);
+									};
+									for (probe in data.NT) {
+										chart.data.datasets[probe_mapper['targets'][probe]].data.push(data.NT[probe][index]);
+									};
 								};
-								for (probe in data.current.F) {
-									chart.data.datasets[probe_mapper['probes'][probe]].data.push(data.current.F[probe]);
-								};
-								for (probe in data.current.NT) {
-									chart.data.datasets[probe_mapper['targets'][probe]].data.push(data.current.NT[probe]);
+								if (data.T.length > 0) {
+									lastSampleTime = data.T[data.T.length - 1];
 								};
 
 								if (annotation_enabled == true) {
-									chart.options.plugins.annotation.annotations = data.annotations;
-								} else {
-									chart.options.plugins.annotation.annotations = {};
+									Object.assign(chart.options.plugins.annotation.annotations, data.annotations);
 								};
+								annotationCount = data.annotation_count;
 							};
 						});
 					}
@@ -192,9 +203,15 @@ function checkHashChange(cur_hash) {
 };
 
 // Get initial chart 
-function refreshChartData(zoom) {
+function refreshChartData(zoom, startTimestamp, endTimestamp) {
 	var newDuration = $("#minutes").val();
-	if(zoom) {
+	if(zoom && (startTimestamp !== undefined)) {
+		// Fetch only the visible window
+		var postdata = { 
+			'start_ms' : Math.floor(startTimestamp),
+			'end_ms' : Math.ceil(endTimestamp)
+		};
+	} else if(zoom) {
 		var postdata = { 
 			'zoom' : newDuration
 		};
@@ -220,7 +237,12 @@ function refreshChartData(zoom) {
 			// Update chart datasets
 			temperatureCharts.data.datasets = data.chart_data;
 			// Update annotations 
-			temperatureCharts.options.plugins.annotation.annotations = data.annotations;
+			temperatureCharts.options.plugins.annotation.annotations = annotation_enabled ? data.annotations : {};
+			annotationCount = data.annotation_count;
+			// Continue streaming from the last sample on the chart (or from the previous sample if there are none)
+			if (data.time_labels.length > 0) {
+				lastSampleTime = data.time_labels[data.time_labels.length - 1];
+			};
 			// Update Chart
 			temperatureCharts.update();
 			// Update probe mapper object 
@@ -275,16 +297,14 @@ $("#annotation_enabled").change(function() {
 		annotation_enabled = false;
 	};
 
-	// If streaming is paused, update chart manually
-	if(paused == true) {
-		if (annotation_enabled == true) {
-			$.get("/historyupdate/stream", function(data) {
-				temperatureCharts.options.plugins.annotation.annotations = data.annotations;
-			});
-		} else {
-			temperatureCharts.options.plugins.annotation.annotations = {};
-		};			
-		// Update Chart
+	// Streaming only sends new annotations, so load the full set when re-enabled
+	if (annotation_enabled == true) {
+		$.get("/historyupdate/stream", function(data) {
+			temperatureCharts.options.plugins.annotation.annotations = data.annotations;
+			temperatureCharts.update();
+		});
+	} else {
+		temperatureCharts.options.plugins.annotation.annotations = {};
 		temperatureCharts.update();
 	};
 });